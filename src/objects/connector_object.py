@@ -9,8 +9,16 @@
 """
 
 import random
+import functools
+import hashlib
 import numpy as np
 import math
+from scipy.special import gammaln
+
+
+# Maximum number of gap-score tables (one per sequence length and recognizer
+# sizes) cached by each connector
+MAX_CACHED_GAP_SCORE_TABLES = 64
 
 
 def norm_cdf(x, mu, sigma):
@@ -35,29 +43,31 @@ def norm_pf(x, mu, sigma):
             p = 0
     return p
 
-def prob_of_d(d, L, N):
+@functools.lru_cache(maxsize=1024)
+def null_log2_probs(L, N):
     ''' Given N randomly chosen integers in [1,L], this function returns the
-    probability that two consecutive integers (after sorting) are found at a
-    distance d. '''
-    if 1 <= d and d <= L-N+1:
-    #if 1 <= d and d <= L:
-        num = math.comb(L-d, N-1)
-        den = math.comb(L, N)
-        return num / den
-    else:
-        # !!! This probability should be 0. In the python implementation of the
-        # placement algorithm "impossible" paths are considered: gaps that are
-        # too large (some PSSM would not fit the DNA sequence on the right) are
-        # not skipped! Instead the values are stored in the matrix. As in the
-        # Needleman–Wunsch algorithm, they just will never reach the bottom line
-        # of the alignment/placement matrix, so they are implicitly discarded.
-        # No placement with such large gap can ever be observed in any practical
-        # situations (because PSSMs are not allowed to overlap, no matter what).
-        # However, we can't return 0, because it would cause a zero division
-        # error when computing those useless cells in the upper right corner of
-        # the placement matrix. Here we return 10^-10 instead, so that no error
-        # is encountered when filling the matrix.
-        return 10**(-10)
+    log2 of the probability that two consecutive integers (after sorting) are
+    found at a distance d, for every d from 0 to L, as an array indexed by d.
+    
+    The probability is comb(L-d, N-1) / comb(L, N), computed in log space
+    with the log-gamma function. Impossible distances (d < 1 or d > L-N+1)
+    have probability 0 (log2 is -inf): this happens for gaps that are too
+    large for the following PSSMs to fit the DNA sequence on the right. Such
+    gaps are outside the feasible columns of the placement matrix, so they
+    are not even evaluated by the placement.
+    
+    Tables are cached, and shared by all the connectors (they only depend on
+    the effective length and on the number of recognizers). '''
+    d = np.arange(max(L + 1, 0))
+    log2_probs = np.full(len(d), -1 * np.inf)
+    possible = (d >= 1) & (d <= L-N+1)
+    if possible.any():
+        d = d[possible]
+        log_num = gammaln(L-d+1) - gammaln(N) - gammaln(L-d-N+2)
+        log_den = gammaln(L+1) - gammaln(N+1) - gammaln(L-N+1)
+        log2_probs[possible] = (log_num - log_den) / np.log(2)
+    log2_probs.flags.writeable = False
+    return log2_probs
 
 
 class ConnectorObject():
@@ -91,11 +101,22 @@ class ConnectorObject():
         self.expected_seq_length = config["EXPECTED_SEQ_LENGTH"]
         self.sigma_mutator = config["SIGMA_MUTATOR"] #log or linear
         self.mu_mutator = config["MU_MUTATOR"] #log or linear
+        # banded placement: only gaps within mu +/- k*sigma are evaluated,
+        # where k is the number of sigmas (None disables the banded mode)
+        self.placement_band_sigmas = config["PLACEMENT_BAND_SIGMAS"]
         
         # precompute connector energies for expected length range
         self.stored_pdfs = []
         self.stored_cdfs = []
         self.set_precomputed_pdfs_cdfs()
+        
+        # gap-score tables, computed by gap_scores, keyed by sequence length
+        # and recognizer sizes
+        self.gap_scores_cache = {}
+        
+        # fingerprint of the parameters the gap scores depend on, computed
+        # by get_fingerprint (emptied together with the gap-score tables)
+        self.fingerprint = None
     
     # Setters
     def set_mu(self, _mu: int) -> None:
@@ -105,6 +126,8 @@ class ConnectorObject():
             _mu: Mean distance between nodes connected by connector
         """
         self._mu = _mu
+        self.gap_scores_cache = {}
+        self.fingerprint = None
 
     def set_sigma(self, sigma: int) -> None:
         """Set sigma variable
@@ -114,6 +137,8 @@ class ConnectorObject():
             by connector
         """
         self._sigma = sigma
+        self.gap_scores_cache = {}
+        self.fingerprint = None
     
     def set_precomputed_pdfs_cdfs(self) -> None:
         """Set stored_pdfs variable and stored_cdfs variable
@@ -122,6 +147,8 @@ class ConnectorObject():
         # Delete previous values
         self.stored_pdfs = []
         self.stored_cdfs = []
+        self.gap_scores_cache = {}
+        self.fingerprint = None
         
         # Compute new values
         for dist in range(self.expected_seq_length):
@@ -138,15 +165,22 @@ class ConnectorObject():
                 else:
                     self.stored_cdfs.append(1.0)
     
-    def mutate(self, org_factory) -> None:
+    def mutate(self, org_factory) -> bool:
         """mutation for a connector
 
         Args:
             org_factory(organism_factory): Organism Facory
+
+        Returns:
+            Whether mu or sigma were mutated
         """
         
+        # Whether any mutation operator was applied
+        changed = False
+        
         # SIGMA MUTATION
         if random.random() < self.mutate_probability_sigma:
+            changed = True
             #determine type of mutation (linear or log)
             if self.sigma_mutator=="linear":
                 # Update sigma with a random permutation within allowed interval
@@ -165,6 +199,7 @@ class ConnectorObject():
        
         # MU MUTATION
         if random.random() < self.mutate_probability_mu:
+            changed = True
             #determine type of mutation (linear or log)
             if self.mu_mutator=="linear":
                 # Update mu with a random permutation within allowed interval
@@ -183,91 +218,122 @@ class ConnectorObject():
             elif self.mu_mutator=="standard":
                 self._mu = abs(random.gauss(self._mu, self._sigma))
         
-        # Recompute PDF and CDF values
-        self.set_precomputed_pdfs_cdfs()
+        # Recompute PDF and CDF values (the gap-score tables are kept if
+        # nothing changed)
+        if changed:
+            self.set_precomputed_pdfs_cdfs()
+        return changed
     
     
-    # !!! New null model function
-    def null_gap_likelihood(self, gap_size, recog_sizes, seq_len):
-        # For each recog of size s, we must subtract (s-1). E.g., for a recog of
-        # size 5 we must subtract 4.
+    def null_gap_log2_likelihoods(self, recog_sizes, seq_len):
+        """ Returns the log2 of the probability of every gap size from 0 to
+            seq_len - 1 under the null model, as an array indexed by gap size
+            (-inf for the impossible gaps). The null model is read from the
+            table of the effective length (seq_len minus the recognizer sizes,
+            plus one per recognizer), where the distance is the gap size + 1.
+        """
         effective_len = seq_len - sum(recog_sizes) + len(recog_sizes)
+        log2_probs = null_log2_probs(effective_len, len(recog_sizes))
         
         # Distance = gap + 1
-        # The length to be used as input is the effective length
-        # Number of recognizers is the length of the list of recog sizes
-        return prob_of_d(gap_size+1, effective_len, len(recog_sizes))
+        log2_likelihoods = np.full(max(seq_len, 0), -1 * np.inf)
+        n_possible = max(min(len(log2_likelihoods), len(log2_probs) - 1), 0)
+        log2_likelihoods[:n_possible] = log2_probs[1:n_possible+1]
+        return log2_likelihoods
     
     
-    def get_score(self, d, s_dna_len, recog_sizes) -> float:
-        """ Returns the score of the connector, given the observed distance
-            and the length of the DNA sequence on which it is being evaluated.
-            Parameters
-            ----------
-            d : observed distancce
-            s_dna_len : length of DNA sequence on which connector is placed
-    
-            Returns
-            -------
-            e_connector : the connector's score
+    def gap_scores(self, s_dna_len, recog_sizes) -> np.ndarray:
+        """ Returns the scores of the connector for all the observable
+            distances d (from 0 to s_dna_len - 1) on a DNA sequence of the
+            given length, as an array indexed by d.
             
             The score of the connector is computed as a log-likelihood ratio.
-            The numerator is the probability of observing the distance provided
-            given the connector's parameters.
-            The probability of observing distance d, given the connector's
-            parameters is given by norm_pf.
-            The probability is then normalized by the cumulative probability
-            function within the observable range on the sequence.
-            
-            The denominator is the probability of observing the distance
-            provided under the null hypothesis.
+            The numerator is the probability of observing distance d given
+            the connector's parameters (see norm_pf), normalized by the
+            cumulative probability within the observable range on the
+            sequence. The denominator is the probability of observing d under
+            the null hypothesis (see null_log2_probs).
             
-            To speed up the process, pdfs and cdfs are precomputed for the
-            "expected" distance range during connector construction, and looked
-            up, rather than recomputed here.
-
+            The table is computed once (with array operations) for each
+            sequence length and recognizer sizes, and then looked up. The
+            cache is emptied when mu or sigma change.
         """
-        # Numerator
-        if d<self.expected_seq_length:
-            numerator = self.stored_pdfs[d]
-        else:
-            numerator = norm_pf(d, self._mu, self._sigma)
+        key = (s_dna_len, tuple(recog_sizes))
+        table = self.gap_scores_cache.get(key)
+        if table is not None:
+            return table
         
-        # Normalize by AUC within the range of observable d values
         max_d = s_dna_len - 1  # Maximum d observable
-        # min_d = -1 * max_d  # Minimum d observable
+        distances = np.arange(max(s_dna_len, 0))
+        if len(distances) == 0:
+            return np.zeros(0)
         
+        # Numerator (precomputed pdfs are used within the expected range)
+        n_stored = min(len(distances), self.expected_seq_length)
+        numerators = np.empty(len(distances))
+        numerators[:n_stored] = self.stored_pdfs[:n_stored]
+        numerators[n_stored:] = [norm_pf(d, self._mu, self._sigma)
+                                 for d in range(n_stored, len(distances))]
+        
+        # Normalize by AUC within the range of observable d values
         if self._sigma == 0:
-            auc = 1.0  # all the gaussian is within the (-(L-1), +(L-1)) range
+            auc = 1.0
+        elif max_d<self.expected_seq_length:
+            auc = self.stored_cdfs[max_d] - self.stored_cdfs[0]
         else:
-            if max_d<self.expected_seq_length:
-                auc = self.stored_cdfs[max_d] - self.stored_cdfs[0]
-            else:
-                auc = (norm_cdf(max_d, self._mu, self._sigma) -
-                       norm_cdf(0, self._mu, self._sigma))
-        
-        # Avoid zero-division error
-        # This will never happen, unless an organism evolves an extremely large sigma
+            auc = (norm_cdf(max_d, self._mu, self._sigma) -
+                   norm_cdf(0, self._mu, self._sigma))
         if auc < 1e-100:
             auc = 1e-100 
-            print("AUC was 0 with mu =", self._mu, "and sigma =", self._sigma)                
-        
-        # avoid log(0) error when computing e_connector
-        if numerator < 1e-100:
-            numerator = 1e-100        
-
-        # Apply normalization
-        numerator = numerator / auc
+            print("AUC was 0 with mu =", self._mu, "and sigma =", self._sigma)
         
-        # Denominator
-        # The denominator is p(d) according to the null model
-        denominator = self.null_gap_likelihood(abs(d), recog_sizes, s_dna_len)
+        # avoid log(0) error when computing the scores
+        numerators = np.maximum(numerators, 1e-100) / auc
         
-        # compute additive connector energy term as log-likelihood ratio
-        e_connector = np.log2(numerator / denominator)
+        # Denominators: p(d) according to the null model (log2). Impossible
+        # distances are scored -inf
+        log2_denominators = self.null_gap_log2_likelihoods(recog_sizes, s_dna_len)
+        possible = log2_denominators > -1 * np.inf
+        table = np.full(len(distances), -1 * np.inf)
+        table[possible] = np.log2(numerators[possible]) - log2_denominators[possible]
+        table.flags.writeable = False
         
-        return e_connector
-
+        # Store the table, dropping the oldest one if the cache is full
+        if len(self.gap_scores_cache) >= MAX_CACHED_GAP_SCORE_TABLES:
+            del self.gap_scores_cache[next(iter(self.gap_scores_cache))]
+        self.gap_scores_cache[key] = table
+        return table
+    
+    def get_fingerprint(self) -> bytes:
+        """ Returns a digest of everything the gap scores of the connector
+            depend on (mu, sigma, the precomputed pdfs and cdfs, and the
+            band of the banded mode). Connectors with the same fingerprint
+            score all the gaps the same way.
+        """
+        if self.fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.array([self._mu, self._sigma], dtype=float).tobytes())
+            digest.update(np.array(self.stored_pdfs, dtype=float).tobytes())
+            digest.update(np.array(self.stored_cdfs, dtype=float).tobytes())
+            digest.update(repr(self.placement_band_sigmas).encode())
+            self.fingerprint = digest.digest()
+        return self.fingerprint
+    
+    def get_gap_band(self):
+        """ Returns the smallest and largest gap sizes (d >= 1) evaluated on
+            the gap rows of the placement matrix in banded mode, i.e. the
+            sizes within mu +/- k*sigma, where k is set by
+            PLACEMENT_BAND_SIGMAS. 0-bp gaps are always evaluated.
+            
+            Returns None if the banded mode is off (all the gap sizes are
+            evaluated).
+        """
+        if self.placement_band_sigmas is None:
+            return None
+        half_width = self.placement_band_sigmas * self._sigma
+        return (max(math.ceil(self._mu - half_width), 1),
+                math.floor(self._mu + half_width))
+    
     def print(self) -> None:
         """Prints the connector mu and sigma values
         """
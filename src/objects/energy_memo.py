@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Energy memo
+Stores the energies of organisms on sequences, keyed by the fingerprint of
+the organism genome and the sequence ID, so that they are computed only
+once. It's shared by all the organisms (identical genomes share their
+energies), and its size is bounded (least recently used entries are evicted
+first). Each energy is stored with the flag telling whether the band of the
+banded placement mode may have cut off the optimum.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+# Default maximum number of energies stored (set_max_entries changes it)
+DEFAULT_MAX_ENTRIES = 2**18
+
+
+class EnergyMemo:
+    """
+    Energy memo object
+
+    Entries map (genome fingerprint, sequence ID) pairs to (energy, band
+    cutoff flag) pairs. The
+    fingerprint (see OrganismObject.get_genome_fingerprint) changes whenever
+    the genome changes, so entries never need to be invalidated: the ones of
+    genomes that are gone are eventually evicted.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        EnergyMemo object constructor.
+
+        Args:
+            max_entries: maximum number of energies stored
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set_max_entries(self, max_entries) -> None:
+        ''' Sets the maximum number of energies stored, evicting the least
+        recently used ones if needed. '''
+        self.max_entries = max_entries
+        self.evict()
+
+    def get_energies(self, fingerprint, seq_ids) -> np.ndarray:
+        '''
+        Returns the stored energies of the genome with the given fingerprint
+        on the sequences with the given IDs, as an array (NaN for the
+        sequences that are not stored). The entries found become the most
+        recently used ones.
+        '''
+        energies = np.full(len(seq_ids), np.nan)
+        for idx, seq_id in enumerate(seq_ids.tolist()):
+            key = (fingerprint, seq_id)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                energies[idx] = entry[0]
+        return energies
+    
+    def get_band_cutoffs(self, fingerprint, seq_ids) -> np.ndarray:
+        '''
+        Returns the band cutoff flags stored with the energies of the genome
+        with the given fingerprint on the sequences with the given IDs, as a
+        boolean array (False for the sequences that are not stored).
+        '''
+        band_cutoffs = np.zeros(len(seq_ids), dtype=bool)
+        for idx, seq_id in enumerate(seq_ids.tolist()):
+            entry = self.entries.get((fingerprint, seq_id))
+            if entry is not None:
+                band_cutoffs[idx] = entry[1]
+        return band_cutoffs
+
+    def set_energies(self, fingerprint, seq_ids, energies,
+                     band_cutoffs=None) -> None:
+        '''
+        Stores the energies of the genome with the given fingerprint on the
+        sequences with the given IDs, with their band cutoff flags (all False
+        if not given), evicting the least recently used entries if the memo
+        is full.
+        '''
+        if band_cutoffs is None:
+            band_cutoffs = np.zeros(len(seq_ids), dtype=bool)
+        for seq_id, energy, band_cutoff in zip(seq_ids.tolist(), energies.tolist(),
+                                               band_cutoffs.tolist()):
+            key = (fingerprint, seq_id)
+            self.entries[key] = (energy, band_cutoff)
+            self.entries.move_to_end(key)
+        self.evict()
+
+    def evict(self) -> None:
+        ''' Drops the least recently used entries above max_entries. '''
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        ''' Drops all the entries. '''
+        self.entries.clear()
+
+
+# Memo shared by all the organisms of the process
+energy_memo = EnergyMemo()
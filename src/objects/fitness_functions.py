@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Fitness functions
+Computes the fitness of a whole population at once, from the energies of
+the organisms on the positive and negative sets, given as (organisms x
+sequences) arrays (e.g. the ones returned by a population-level placement).
+The statistics are computed along the sequence axis, so any fitness function
+can be fed by the same placement pass.
+
+Fitness functions are registered by name in FITNESS_FUNCTIONS. They all
+take the positive and negative energies and a dictionary of parameters:
+    "cumulative_fit_methods": cumulative fit method of each organism
+    "neg_lengths": lengths of the negative sequences
+    "genome_length": length of the genome (see boltzmannian_fitness)
+    "sequences_to_fit_pos": number of positive sequences used for fitness
+    "sequences_to_fit_neg": number of negative sequences used for fitness
+and return an array with the fitness of each organism.
+"""
+
+import numpy as np
+
+
+# Functions that summarize the energies of the organisms on a set (applied
+# along the sequence axis)
+CUMULATIVE_FIT_METHODS = {
+    "sum": np.sum,
+    "mean": np.mean,
+    "median": np.median,
+}
+
+
+def get_cumulative_scores(energies: np.ndarray,
+                          cumulative_fit_methods: list) -> np.ndarray:
+    '''
+    Returns the score of each organism on a set of sequences, i.e. the sum,
+    mean or median of its energies, according to its cumulative fit method.
+
+    Args:
+        energies: (organisms x sequences) array of energies
+        cumulative_fit_methods: cumulative fit method of each organism
+    '''
+    methods = np.array(cumulative_fit_methods)
+    scores = np.empty(len(energies))
+    for method in np.unique(methods):
+        if method not in CUMULATIVE_FIT_METHODS:
+            raise ValueError('CUMULATIVE_FIT_METHOD should be "sum", ' +
+                             '"mean" or "median".')
+        rows = methods == method
+        scores[rows] = CUMULATIVE_FIT_METHODS[method](energies[rows], axis=1)
+    return scores
+
+
+def get_welchs_standard_errors(pos_stdevs, neg_stdevs, sequences_to_fit_pos: int,
+                               sequences_to_fit_neg: int):
+    '''
+    Returns the standard errors of the differences between the scores on the
+    positive and negative sets (the denominators of the Welch's t scores),
+    given the standard deviations of the energies on the sets (arrays or
+    single values).
+    '''
+    # Lower bound to sigma
+    # (Being more consistent than that on the sets will not help
+    # your fitness)
+    pos_stdevs = np.maximum(pos_stdevs, 1)
+    neg_stdevs = np.maximum(neg_stdevs, 1)
+
+    # Standard errors
+    pos_sterrs = pos_stdevs / sequences_to_fit_pos**(1/2)
+    neg_sterrs = neg_stdevs / sequences_to_fit_neg**(1/2)
+    return (pos_sterrs**2 + neg_sterrs**2)**(1/2)
+
+
+def get_ks_statistics(pos_energies: np.ndarray,
+                      neg_energies: np.ndarray) -> np.ndarray:
+    '''
+    Returns the two-sample Kolmogorov-Smirnov statistic of each organism,
+    i.e. the maximum distance between the empirical cumulative distribution
+    functions of its energies on the positive and negative sets (the same
+    value as scipy.stats.ks_2samp in its exact mode, for all the organisms
+    at once).
+    '''
+    n_pos = pos_energies.shape[1]
+    n_neg = neg_energies.shape[1]
+
+    # Sort the energies of each organism on both sets together, keeping
+    # track of the ones that come from the positive set
+    energies = np.concatenate((pos_energies, neg_energies), axis=1)
+    order = np.argsort(energies, axis=1, kind="stable")
+    sorted_energies = np.take_along_axis(energies, order, axis=1)
+    pos_counts = np.cumsum(order < n_pos, axis=1)
+    neg_counts = np.arange(1, n_pos + n_neg + 1) - pos_counts
+
+    # Distances between the CDFs, in units of 1/lcm(n_pos, n_neg) (integer
+    # counts, so that the statistic is exact)
+    gcd = np.gcd(n_pos, n_neg)
+    lcm = (n_pos // gcd) * n_neg
+    cdf_diffs = np.abs(pos_counts * n_neg - neg_counts * n_pos) // gcd
+
+    # The CDFs are only evaluated after the last of each run of equal values
+    last_of_run = np.ones(energies.shape, dtype=bool)
+    last_of_run[:, :-1] = sorted_energies[:, 1:] != sorted_energies[:, :-1]
+    return np.max(np.where(last_of_run, cdf_diffs, 0), axis=1) * 1.0 / lcm
+
+
+def get_boltzmann_probabilities(pos_energies: np.ndarray, neg_energies: np.ndarray,
+                                neg_lengths, genome_length: int) -> np.ndarray:
+    '''
+    Returns the probability that each organism binds a positive sequence,
+    turning its energies into probabilities according to a Boltzmannian
+    distribution (see OrganismObject.get_boltz_fitness).
+    '''
+    pos_values = np.e**pos_energies  # exp(energy)
+    neg_values = np.e**neg_energies
+
+    # Scaling factor, used to over-represent the negative scores, so that
+    # it simulates a genome of specified length
+    neg_factor = genome_length // np.sum(neg_lengths)
+
+    # Partition function
+    Z = np.sum(pos_values, axis=1) + neg_factor * np.sum(neg_values, axis=1)
+
+    return np.sum(pos_values, axis=1) / Z
+
+
+def boltzmannian_fitness(pos_energies: np.ndarray, neg_energies: np.ndarray,
+                         params: dict) -> np.ndarray:
+    ''' Probability of binding a positive sequence (rounded to 8 decimals). '''
+    return np.round(get_boltzmann_probabilities(
+        pos_energies, neg_energies, params["neg_lengths"],
+        params["genome_length"]), 8)
+
+
+def kolmogorov_fitness(pos_energies: np.ndarray, neg_energies: np.ndarray,
+                       params: dict) -> np.ndarray:
+    ''' Kolmogorov-Smirnov statistic (rounded to 8 decimals). '''
+    return np.round(get_ks_statistics(pos_energies, neg_energies), 8)
+
+
+def discriminative_fitness(pos_energies: np.ndarray, neg_energies: np.ndarray,
+                           params: dict) -> np.ndarray:
+    ''' Difference between the scores on the positive and negative sets. '''
+    methods = params["cumulative_fit_methods"]
+    return (get_cumulative_scores(pos_energies, methods) -
+            get_cumulative_scores(neg_energies, methods))
+
+
+def welchs_fitness(pos_energies: np.ndarray, neg_energies: np.ndarray,
+                   params: dict) -> np.ndarray:
+    ''' Welch's t score of the scores on the positive and negative sets. '''
+    st_errors = get_welchs_standard_errors(
+        np.std(pos_energies, axis=1), np.std(neg_energies, axis=1),
+        params["sequences_to_fit_pos"], params["sequences_to_fit_neg"])
+    return discriminative_fitness(pos_energies, neg_energies, params) / st_errors
+
+
+FITNESS_FUNCTIONS = {
+    "boltzmannian": boltzmannian_fitness,
+    "kolmogorov": kolmogorov_fitness,
+    "discriminative": discriminative_fitness,
+    "welchs": welchs_fitness,
+}
+
+
+def get_fitness_function(name: str):
+    ''' Returns the fitness function registered with the given name. '''
+    if name not in FITNESS_FUNCTIONS:
+        raise Exception("Not a valid fitness function name, "
+                        + "check the configuration file.")
+    return FITNESS_FUNCTIONS[name]
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Gap transition
+Computes the best gap (horizontal move) landing on each cell of a row of the
+placement matrix, i.e. the max-plus convolution of the row with the gap
+scores of a connector, without evaluating every (origin, destination) pair.
+In banded placement mode, it also bounds the scores of the gaps left outside
+the band.
+"""
+
+import numpy as np
+
+
+# Number of gap sizes (those with the highest scores) used to compute the
+# lower bound of the best gap landing on each cell
+N_LOWER_BOUND_SIZES = 8
+
+# Smallest number of gap sizes evaluated together for a group of cells
+MIN_BUCKET_SIZE = 16
+
+# Maximum number of candidate gaps evaluated at once (bounds the memory used
+# by large batches)
+MAX_CANDIDATES = 2**22
+
+
+def gap_transition(diag_row, gap_scores_by_size, min_size=1, max_size=None):
+    '''
+    Returns, for each column j of the row, the best gap score landing on j,
+        best[j] = max over s < j of diag_row[s] + gap_scores_by_size[j - s]
+    and the origin column s of that gap. Among equally good gaps, the one
+    with the rightmost origin is chosen (-inf gaps included). Column 0 has
+    no gaps (best is -inf and origin is -1). If min_size and max_size are
+    given, only the gaps with sizes in that range are considered (banded
+    placement).
+
+    The result is exactly the same as evaluating all the (s, j) pairs, but
+    gaps that can't be the best are skipped: the score of a gap of size d is
+    at most h(d) = max(diag_row) + gap_scores_by_size[d], and it can be
+    skipped when h(d) is below a lower bound of best[j], taken from a few
+    gaps of the sizes with the highest scores. Since connector scores drop
+    quickly away from mu, only a narrow band of gap sizes is evaluated for
+    most columns. For flat connectors (or flat rows) the band gets wider, up
+    to all the gap sizes (quadratic cost).
+
+    diag_row can also be a 2D array with the rows of a batch of sequences of
+    the same length (one per line). The results then have the same shape.
+    The gap scores are either shared by all the lines, or given for each
+    line as a 2D array (e.g. for a batch of organisms).
+
+    Args:
+        diag_row: scores of the row before the gap moves (N+1 columns)
+        gap_scores_by_size: gap score for each gap size from 0 to N (the
+                            score of size 0 is not used), or one line of
+                            gap scores for each line of diag_row
+        min_size: smallest gap size considered (at least 1)
+        max_size: largest gap size considered (None for N)
+    '''
+    shape = np.shape(diag_row)
+    diag_rows = np.atleast_2d(diag_row)
+    n = diag_rows.shape[1] - 1
+    best_gap_scores = np.full(diag_rows.shape, -1 * np.inf)
+    best_origins = np.full(diag_rows.shape, -1, dtype=np.int64)
+    min_size = max(min_size, 1)
+    max_size = n if max_size is None else min(max_size, n)
+    if max_size < min_size:
+        return best_gap_scores.reshape(shape), best_origins.reshape(shape)
+
+    # If no cell of a row can be the origin of a gap, all the gaps are -inf,
+    # and the rightmost origin is the one of the smallest gap
+    cols = np.arange(n+1)
+    max_diag = diag_rows.max(axis=1)
+    no_origins = max_diag == -1 * np.inf
+    best_origins[np.ix_(no_origins, cols[min_size:])] = cols[:n+1-min_size]
+
+    # Gap sizes sorted by decreasing score (ties by increasing size), for
+    # each line
+    sizes = np.arange(min_size, max_size+1)
+    if np.ndim(gap_scores_by_size) == 1:
+        order = sizes[np.argsort(-gap_scores_by_size[sizes], kind="stable")]
+        order = np.broadcast_to(order, (len(diag_rows), len(sizes)))
+    else:
+        order = sizes[np.argsort(-gap_scores_by_size[:, sizes], axis=1,
+                                 kind="stable")]
+    gap_scores = np.broadcast_to(gap_scores_by_size, diag_rows.shape)
+
+    # Lower bound of the best gap landing on each cell
+    lower_bounds = np.empty(diag_rows.size)
+    chunk_size = max(MAX_CANDIDATES // N_LOWER_BOUND_SIZES, 1)
+    for start in range(0, diag_rows.size, chunk_size):
+        cells = np.arange(start, min(start + chunk_size, diag_rows.size))
+        line_idx, col_idx = np.divmod(cells, n+1)
+        lower_bounds[cells] = _evaluate_gaps(
+            diag_rows, gap_scores, line_idx, col_idx,
+            order[line_idx, :N_LOWER_BOUND_SIZES])[0]
+    lower_bounds = lower_bounds.reshape(diag_rows.shape)
+
+    # Number of sizes (in the sorted order) whose upper bound reaches the
+    # lower bound of each cell. The other sizes can be skipped.
+    upper_bounds = max_diag[:, None] + np.take_along_axis(gap_scores, order, axis=1)
+    n_sizes = _count_reaching(upper_bounds, lower_bounds)
+
+    # Evaluate cells in groups needing a similar number of gap sizes
+    bucket_size = MIN_BUCKET_SIZE
+    pending = np.ones(diag_rows.shape, dtype=bool)
+    pending[:, 0] = False
+    pending[no_origins] = False
+    while pending.any():
+        if bucket_size >= order.shape[1]:
+            bucket = np.nonzero(pending)
+        else:
+            bucket = np.nonzero(pending & (n_sizes <= bucket_size))
+        chunk_size = max(MAX_CANDIDATES // bucket_size, 1)
+        for start in range(0, len(bucket[0]), chunk_size):
+            chunk = (bucket[0][start:start + chunk_size],
+                     bucket[1][start:start + chunk_size])
+            scores, origins = _evaluate_gaps(diag_rows, gap_scores,
+                                             chunk[0], chunk[1],
+                                             order[chunk[0], :bucket_size])
+            best_gap_scores[chunk] = scores
+            best_origins[chunk] = origins
+        pending[bucket] = False
+        bucket_size *= 2
+
+    return best_gap_scores.reshape(shape), best_origins.reshape(shape)
+
+
+def _count_reaching(upper_bounds, lower_bounds):
+    '''
+    Returns, for each cell, the number of upper bounds of its line (sorted in
+    decreasing order) that are at least as large as its lower bound, with a
+    binary search run on all the cells at once.
+    '''
+    n_lines, n_bounds = upper_bounds.shape
+    lines = np.arange(n_lines)[:, None]
+    low = np.zeros(lower_bounds.shape, dtype=np.int64)
+    high = np.full(lower_bounds.shape, n_bounds, dtype=np.int64)
+    while (low < high).any():
+        mid = (low + high) // 2
+        reaching = upper_bounds[lines, np.minimum(mid, n_bounds - 1)] >= lower_bounds
+        active = low < high
+        low = np.where(active & reaching, mid + 1, low)
+        high = np.where(active & ~reaching, mid, high)
+    return low
+
+
+def _evaluate_gaps(diag_rows, gap_scores, line_idx, dest_cols, gap_sizes):
+    '''
+    Evaluates the gaps landing on the given cells (line line_idx and column
+    dest_cols of diag_rows), with the given sizes for each cell. Returns the
+    best score for each cell, and the rightmost origin column among the best
+    gaps (-1 if no gap of these sizes fits).
+    '''
+    origins = dest_cols[:, None] - gap_sizes
+    valid = origins >= 0
+    candidates = np.where(valid, diag_rows[line_idx[:, None], np.maximum(origins, 0)] +
+                          gap_scores[line_idx[:, None], gap_sizes], -1 * np.inf)
+    best = candidates.max(axis=1)
+    best_origins = np.where(valid & (candidates == best[:, None]),
+                            origins, -1).max(axis=1)
+    return best, best_origins
+
+
+def get_out_of_band_bounds(diag_row, influence_row, gap_scores_by_size,
+                           min_size, max_size):
+    '''
+    Returns, for each column j of the row, an upper bound of the score up to
+    j (after the gap moves of the row) of the placements with a gap outside
+    the band (sizes from min_size to max_size), -inf if none: those whose gap
+    on this row is outside the band, landing on j from diag_row, and those
+    with a gap outside the band on a previous row, whose diagonal scores on
+    this row are bounded by influence_row (their gap on this row can have
+    any size). diag_row and influence_row can also hold the rows of a batch
+    of sequences of the same length (one per line).
+
+    The gaps are bounded by buckets of sizes (see get_gap_upper_bounds),
+    growing away from each edge of the band, or from the mode of the
+    connector for the placements of influence_row.
+    '''
+    max_gap_size = len(gap_scores_by_size) - 1
+    buckets = (get_size_buckets(1, min(min_size - 1, max_gap_size), min_size - 1) +
+               get_size_buckets(max(max_size + 1, 1), max_gap_size, max_size + 1))
+    bounds = np.maximum(influence_row, get_gap_upper_bounds(
+        diag_row, gap_scores_by_size, buckets))
+    if np.isfinite(influence_row).any() and max_gap_size >= 1:
+        mode = int(np.argmax(gap_scores_by_size[1:])) + 1
+        bounds = np.maximum(bounds, get_gap_upper_bounds(
+            influence_row, gap_scores_by_size,
+            get_size_buckets(1, max_gap_size, mode)))
+    return bounds
+
+
+def get_gap_upper_bounds(diag_row, gap_scores_by_size, buckets):
+    '''
+    Returns, for each column j of the row, an upper bound of the best score
+    of the gaps landing on j with the sizes of the given buckets ((smallest,
+    largest) pairs of sizes), -inf if none fits. diag_row can also hold the
+    rows of a batch of sequences of the same length (one per line).
+
+    The score of any gap of a bucket landing on j is bounded by the best
+    diagonal score on the origins of those sizes (j - largest to j -
+    smallest) plus the best score of those sizes, in linear time for each
+    bucket (see sliding_max). Gap scores fall away from the mode of the
+    connector, so small buckets near it and larger ones far from it give
+    tight bounds.
+    '''
+    n = diag_row.shape[-1] - 1
+    gap_bounds = np.full(diag_row.shape, -1 * np.inf)
+    for smallest, largest in buckets:
+        if smallest > n:
+            continue
+        gap_bounds[..., smallest:] = np.maximum(
+            gap_bounds[..., smallest:],
+            sliding_max(diag_row[..., :n+1-smallest], largest - smallest + 1) +
+            gap_scores_by_size[smallest:largest + 1].max())
+    return gap_bounds
+
+
+def get_size_buckets(smallest, largest, center):
+    '''
+    Splits the gap sizes from smallest to largest in buckets ((smallest,
+    largest) pairs) of 1, 2, 4... sizes away from the given center size, on
+    both sides of it.
+    '''
+    buckets = []
+    if smallest > largest:
+        return buckets
+    center = min(max(center, smallest), largest)
+    bucket_width = 1
+    top = center - 1
+    while top >= smallest:
+        buckets.append((max(top - bucket_width + 1, smallest), top))
+        top -= bucket_width
+        bucket_width *= 2
+    bucket_width = 1
+    bottom = center
+    while bottom <= largest:
+        buckets.append((bottom, min(bottom + bucket_width - 1, largest)))
+        bottom += bucket_width
+        bucket_width *= 2
+    return buckets
+
+
+def sliding_max(values, width):
+    '''
+    Returns the max of each window of width values ending on each position
+    of the last axis (windows are cut at the start of the axis), computed in
+    linear time from the running max of blocks of width values, forwards
+    and backwards (van Herk / Gil-Werman).
+    '''
+    length = values.shape[-1]
+    width = min(width, length)
+    if width <= 1:
+        return values.copy()
+    n_blocks = -(-length // width)
+    padded = np.full(values.shape[:-1] + (n_blocks * width,), -1 * np.inf)
+    padded[..., :length] = values
+    blocks = padded.reshape(values.shape[:-1] + (n_blocks, width))
+
+    # Max from the start of each block, and from each position to the end
+    # of its block
+    forward = np.maximum.accumulate(blocks, axis=-1).reshape(padded.shape)
+    backward = np.maximum.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(
+        padded.shape)
+
+    # The window ending on i spans the end of the block of its first
+    # position and the start of the block of i
+    result = forward[..., :length].copy()
+    result[..., width-1:] = np.maximum(result[..., width-1:],
+                                       backward[..., :length-width+1])
+    return result
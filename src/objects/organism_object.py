@@ -6,10 +6,19 @@ It allocates the full data structure
 
 
 import random
+import bisect
+import hashlib
 import numpy as np
-from scipy.stats import ks_2samp
 import copy
 from .placement_object import PlacementObject
+from .placement_plan_object import PlacementPlan
+from .gap_transition import (gap_transition, get_out_of_band_bounds,
+                             get_gap_upper_bounds, get_size_buckets)
+from .energy_memo import energy_memo
+from .placement_cache import get_window_scores
+from .fitness_functions import (get_cumulative_scores, get_ks_statistics,
+                                get_boltzmann_probabilities)
+from .sequence_dataset_object import as_encoded_sequence, decode_dna_sequence
 
 
 class OrganismObject:
@@ -86,6 +95,10 @@ class OrganismObject:
         # column of a PSSM: each row is assigned a [pssm_idx, column_idx]
         self.row_to_pssm = []
         
+        # Compiled placement plan (typed arrays read by the placement
+        # engines), rebuilt together with row_to_pssm
+        self.placement_plan = None
+        
         # Dictionary storing information about how the organism has to be
         # assembled by the recombination process. All the values are
         # initialized as None.
@@ -250,6 +263,8 @@ class OrganismObject:
            Call by factory upon generation of organism, and also after any
            mutations that might change the size of the pssm, or the column order,
            or their number.
+           
+           It also compiles the placement plan used by the placement engines.
         """
         
         pssm_list = self.recognizers
@@ -265,10 +280,13 @@ class OrganismObject:
         
         # Token row
         # (this ensures that the last row will be considered the row of the last
-        # position of a PSSM when calling self.is_last() on it)
+        # position of a PSSM in PlacementPlan.is_last_row)
         row_to_pssm_list.append([None, 0])
         
         self.row_to_pssm = row_to_pssm_list
+        
+        # Compile the placement plan anew (the PSSMs may have changed, too)
+        self.placement_plan = PlacementPlan(row_to_pssm_list, pssm_list)
 
     def get_id(self) -> int:
         """Getter _id
@@ -286,14 +304,20 @@ class OrganismObject:
         """
         self._id = _id
         
-    def mutate(self, org_factory) -> None:
+    def mutate(self, org_factory) -> bool:
         """Mutates an organism based on JSON configured probabilities
 
         Args:
             org_factory (OrganismFactory): Factory of organisms and node
                                            components
+
+        Returns:
+            Whether any mutation operator was applied (if not, the organism
+            is left exactly as it was)
         """
 
+        # Whether any mutation operator was applied
+        changed = False
         
         # Delete a recognizer (and one parent connector)
         if random.random() < self.mutate_probability_delete_recognizer:
@@ -301,6 +325,7 @@ class OrganismObject:
             n_recognizers = self.count_recognizers()
             # if this is a single-node organism, skip deletion
             if n_recognizers != 1:
+                changed = True
     			# "blind" method: the remaining connector is left unchanged
                 if self.deletion_method == "blind":
                     # Choose randomly the recognizer to be deleted
@@ -392,6 +417,9 @@ class OrganismObject:
                         # set new mu and new sigma
                         self.connectors[connector_to_stretch].set_mu(adj_mu)
                         self.connectors[connector_to_stretch].set_sigma(adj_sigma)
+                        
+                        # Update connector's PDF and CDF values
+                        self.connectors[connector_to_stretch].set_precomputed_pdfs_cdfs()
     
     				# recreate vector of recognizers and connectors
     				# skipping the recgonizer/connector selected for deletion					
@@ -407,6 +435,7 @@ class OrganismObject:
         
         # Insert a recognizer (and one parent connector)
         if random.random() < self.mutate_probability_insert_recognizer:
+            changed = True
             
 			# instantiate the new recognizer and connector
             new_connector = org_factory.create_connector()
@@ -557,6 +586,10 @@ class OrganismObject:
                     new_connector.set_sigma(
                         np.sqrt(var_new_connector * var_scaling_factor)
                     )
+                    
+                    # Update connectors' PDF and CDF values
+                    self.connectors[connector_to_compress].set_precomputed_pdfs_cdfs()
+                    new_connector.set_precomputed_pdfs_cdfs()
                 
 				# recreate vector of connectors/recognizers, adding
 				# the newly minted recognizer+connector and containing
@@ -584,7 +617,8 @@ class OrganismObject:
                 random_node_idx = random.randint(0, n_nodes - 1)
                 if random_node_idx < self.count_recognizers():
                     # mutate a recognizer
-                    moved_pssm_bounds = self.recognizers[random_node_idx].mutate(org_factory)
+                    pssm_changed, moved_pssm_bounds = self.recognizers[random_node_idx].mutate(org_factory)
+                    changed = changed or pssm_changed
                     # Adjust adjacent gaps if needed
                     if moved_pssm_bounds:
                         self.adjust_gaps_after_pssm_bounds_displacement(
@@ -592,14 +626,16 @@ class OrganismObject:
                 else:
                     # mutate a connector
                     connector_idx = random_node_idx - self.count_recognizers()
-                    self.connectors[connector_idx].mutate(org_factory)
+                    connector_changed = self.connectors[connector_idx].mutate(org_factory)
+                    changed = changed or connector_changed
         else:
             # Go through all the nodes
             
             # Recognizers
             for i in range(self.count_recognizers()):
                 # Mutate recognizer with index i
-                moved_pssm_bounds = self.recognizers[i].mutate(org_factory)
+                pssm_changed, moved_pssm_bounds = self.recognizers[i].mutate(org_factory)
+                changed = changed or pssm_changed
                 
                 # Adjust adjacent gaps if needed
                 if moved_pssm_bounds:
@@ -608,12 +644,15 @@ class OrganismObject:
             
             # Connectors
             for connector in self.connectors:
-                connector.mutate(org_factory)
+                connector_changed = connector.mutate(org_factory)
+                changed = changed or connector_changed
         
         # After applying mutations, order/columns/number of pssm's may have
         # changed, so we call the set_row_to_pssm to set their mapping on the
-        # alignment matrix anew
-        self.set_row_to_pssm()
+        # alignment matrix anew (the placement plan is kept if nothing changed)
+        if changed:
+            self.set_row_to_pssm()
+        return changed
     
     def adjust_gaps_after_pssm_bounds_displacement(self, pssm_index,
                                                    pssm_displacement_code):
@@ -697,7 +736,8 @@ class OrganismObject:
 		   sequence, as a function of the cumulative organism energy.
 		   
 		   Inputs:
-		   - dna_sequence: DNA sequence to place on
+		   - dna_sequence: DNA sequence to place on, either as a string or
+		     encoded as base indexes (e.g. an element of a SequenceDataset)
 		   - print_out: bool to indicate whether to print or not the placement
            - out_file: file handle to write placement to, if desired
 		
@@ -715,207 +755,503 @@ class OrganismObject:
 		   - Contiguous (diagonal) PSSM alignment invokes a zero gap using the appropriate
 		     connector
 		   - The alignment matrix is (M+1)x(N+1)
-		   - The traceback matrix (which stores info for traceback) is 2 x (M+1)x(N+1).
-		     - The extra dimension captures the two coordinates for the traceback to cell
+		   - Traceback info is only stored for the rows where gaps are allowed:
+		     for each of them, an int32 array with the column where the gap
+		     landing on each cell comes from (-1 if the cell was reached with
+		     a diagonal move). All the other moves are diagonal.
 		   - Traceback through a gap enforces that a diagonal move must be taken next
 		     (this avoids double gaps in a row)
 		   - Traceback is initiated at the cell with the best value on the bottom row
+
+		   The matrix is filled PSSM by PSSM (see fill_recognizer_rows).
+		   Within a PSSM all the moves are diagonal, so the last row of a
+		   PSSM only depends on the row before the PSSM (E), on the 0-bp gap
+		   scores (Z) and on the scores of the PSSM on each window of the
+		   sequence (W), obtained by scanning the PSSM across the sequence:
+		       D[j] = E[s] + (Z[s] + W[s]),  with s = j - L
+		   where L is the PSSM length. Only D and the row after the gap moves
+		   are kept for each PSSM (R rows instead of M). Gap scores of a row
+		   are computed by the gap_transition kernel.
+		   
+		   Only the feasible cells of each row are computed (see
+		   PlacementPlan.get_feasible_columns): a cell on row i and column j
+		   can only be on a complete placement if i <= j <= N - (M - i).
+		   Gap origins are limited the same way. The other cells are left to
+		   -inf.
+
+		   If PLACEMENT_BAND_SIGMAS is set in the connector configuration
+		   (banded mode), only gaps within mu +/- k*sigma of their connector
+		   are evaluated (0-bp gaps are always evaluated). The placement is
+		   then approximate, and placement.band_cutoff is set when the band
+		   may have cut off the optimum.
+
+		   The positions and scores of the nodes are only traced back when
+		   traceback is required.
 		"""
-    
-        # Initialize the two matrices (alignment + traceback matrices)
-        
-        # Number of rows
-        m = self.sum_pssm_lengths()
-        # Number of columns
-        n = len(dna_sequence)
-        
-        # Initialize matrix of scores (alignment matrix)
-		# Matrix is (M+1)x(N+1), with the extra "fake" row/columns
-		# Matrix is initialized to -inf, then first row set to zero
-        scores_matrix = np.full((m+1, n+1), -1 * np.inf)
-        scores_matrix[0,:] = 0
-        
-        # Initialize matrix of pointers (traceback matrix), to None
-		# Matrix is 2x(M+1)x(N+1), to store row/col of incoming cell
-        pointers_matrix = np.full((2, m+1, n+1), None)
-        
-        # Fill the matrices (top-to-bottom, then left-to-right)
-        for i in range(1, m + 1):
-			# Row fill up is done in two passes:
-			#  - First fill up with possible diagonal scores
-			#  & (for terminal recognizer rows only)
-			#  - Fill up with possible gap scores (horizontal moves)
-			
-            # Diagonal scores over row i
-            for j in range(1, n + 1):
-                # call PSSM column score function with the DNA sequence
-                diag_score = self.get_diag_score(pointers_matrix, i, j, dna_sequence)
-				# assign cumulative score to alignment matrix
-                scores_matrix[i,j] = scores_matrix[i-1, j-1] + diag_score
-                # Annotate "where we came from" in the pointers_matrix
-                pointers_matrix[0][i,j] = i - 1  # row idx of the origin
-                pointers_matrix[1][i,j] = j - 1  # column idx of the origin
-                
-            # Horizontal scores over row i
-            # (only in rows at the interface with the next PSSM)
-            if self.is_last(i) and i != m:
-                
-                # Scores and pointers from horizontal moves are temporarily stored in
-                # the following arrays. They will be written altogether at the end of
-                # the loop over j, to avoid reading them as starting scores for other
-                # horizontal moves at a later cycles in the for loop over j
-				
-				# That is, the matrix with diagonal scores is left untouched, and used
-				# as reference for any gap evaluations. The result of such gap evaluations
-				# is placed on a temporary matrix. The best gap scores are computed there.
-				# This is to avoid adding the gap-to-gap score (instead of
-				# the diagonal score) that has replaced a diagonal score, as we move
-				# further right (because otherwise you could "carry" multiple gap
-				# scores
-                tmp_gap_scores = scores_matrix[i,:].copy()  # vector of length n+1
-                tmp_gap_pointers = pointers_matrix[:,i,:].copy()  # 2 x (n+1) matrix
-                
-				# for each column of the matrix
-                for j in range(1, n + 1):
-                    # Compute all the possible values from all the possible
-                    # horizontal moves (gaps) that land on [i,j]
-                    for start in range(j):
-                        gap_size = j - start	# obtain distance for connector
-						# obtain PSSM index, which is also the connector index
-						# because this is the preceding PSSM
-                        pssm_idx = self.row_to_pssm[i][0]
-						# evaluate the score for connector given distance
-						# the DNA sequence length (n) is needed for the connector
-						# background model
-                        gap_score = self.get_gap_score(pssm_idx, gap_size, n)
-						# add cumulative score (using the score matrix, which has
-						# not been modified by horizontal scores)
-                        candidate_score = scores_matrix[i, start] + gap_score
-                        
-						# assess whether temp scores should be overwritten
-						# that is, whether this gap is better than other gaps
-                        if candidate_score >= tmp_gap_scores[j]:
-                            # Write horizontal score if better than existing
-                            tmp_gap_scores[j] = candidate_score
-                            # Annotate "where we came from" in the tmp_gap_pointers
-                            tmp_gap_pointers[0,j] = i  # row idx of the origin
-                            tmp_gap_pointers[1,j] = start  # column idx of the origin
-                
-                
-                # Update the original matrices
-				# tmp_gap_scores contains the updated matrix, with the diagnonal moves
-				# and any best horizontal moves replacing them if adequate
-                scores_matrix[i,:] = tmp_gap_scores
-                pointers_matrix[:,i,:] = tmp_gap_pointers
-            
-        # Get best binding energy (max value on bottom row)
-        last_row = scores_matrix[-1,:]
-        best = max(last_row)
-        
-        # BACKTRACKING
+
+        # Sequence as an array of base indexes
+        seq_codes = as_encoded_sequence(dna_sequence)
+        final_row, band_cutoff, traceback_rows = self.fill_recognizer_rows(
+            seq_codes, traceback=traceback)
         
         # Initialize placement object
-        placement = PlacementObject(self._id, dna_sequence)
+        # (the sequence is stored as a lowercase DNA string, for printing)
+        placement = PlacementObject(self._id, decode_dna_sequence(seq_codes))
+        
+        # Set the total binding energy (max value on bottom row) in the
+        # placement object, and the placement of the nodes
+        self.set_placement_energy(placement, final_row.max())
+        placement.set_band_cutoff(bool(band_cutoff))
+        if traceback:
+            diag_rows, final_rows, gap_pointers = traceback_rows
+            self.set_placement_nodes(placement, seq_codes, diag_rows, final_rows,
+                                     gap_pointers)
+        
+        return placement
+    
+    def get_energies(self, dataset, return_band_cutoffs=False) -> np.ndarray:
+        """Returns the energies of the organism on all the sequences of the
+           dataset (a SequenceDataset or a list of sequences), in the same
+           order, as an array. Each energy is the one that get_placement
+           sets in the placement, with the lower bound applied (if the
+           energy threshold method is not "organism", energies are returned
+           without lower bound). If return_band_cutoffs is True, the flags
+           telling, for each sequence, whether the band of the banded mode
+           may have cut off the optimum (see get_placement) are returned too,
+           as a second array.
+           
+           Sequences are grouped by length, and the placement matrices of
+           each group are filled together by the recognizer-level engine,
+           each row update applying to the whole group at once.
+           
+           If the dataset is a SequenceDataset, the energies are stored in
+           the energy memo, keyed by genome fingerprint and sequence ID, and
+           only the sequences that are not in the memo are placed (reusing
+           the cached scans of the PSSMs that didn't change). Sequences where
+           the energy is sure to be raised to the threshold are not placed
+           (see is_below_energy_threshold).
+        """
+        seq_ids = getattr(dataset, "ids", None)
+        if seq_ids is None:
+            energies = np.full(len(dataset), np.nan)
+            band_cutoffs = np.zeros(len(dataset), dtype=bool)
+        else:
+            energies = self.get_cached_energies(seq_ids)
+            band_cutoffs = self.get_cached_band_cutoffs(seq_ids)
+        missing = np.flatnonzero(np.isnan(energies))
+        
+        seqs = [as_encoded_sequence(dataset[idx]) for idx in missing]
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        for length in np.unique(lengths):
+            batch_idx = np.flatnonzero(lengths == length)
+            batch = np.stack([seqs[idx] for idx in batch_idx])
+            batch_ids = None if seq_ids is None else seq_ids[missing[batch_idx]]
+            
+            # Energies sure to be raised to the threshold are not placed
+            below = self.is_below_energy_threshold(batch, batch_ids)
+            energies[missing[batch_idx[below]]] = self.energy_threshold_value
+            if below.all():
+                continue
+            batch_idx, batch = batch_idx[~below], batch[~below]
+            batch_ids = None if batch_ids is None else batch_ids[~below]
+            
+            final_row, batch_cutoffs, _ = self.fill_recognizer_rows(batch, batch_ids)
+            energies[missing[batch_idx]] = final_row.max(axis=-1)
+            band_cutoffs[missing[batch_idx]] = batch_cutoffs
+        
+        energies = self.apply_energy_threshold(energies)
+        if seq_ids is not None:
+            self.set_cached_energies(seq_ids, energies, band_cutoffs)
+        if return_band_cutoffs:
+            return energies, band_cutoffs
+        return energies
+    
+    def get_genome_fingerprint(self) -> bytes:
+        """Returns a digest of everything the energies of the organism depend
+           on: the placement plan (recognizer lengths and PSSM scores), the
+           connectors and the energy threshold. Organisms with the same
+           fingerprint have the same energies on all the sequences.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.placement_plan.fingerprint)
+        for connector in self.connectors:
+            digest.update(connector.get_fingerprint())
+        digest.update(repr((self.energy_threshold_method,
+                            self.energy_threshold_value)).encode())
+        return digest.digest()
+    
+    def get_prefix_fingerprints(self) -> list:
+        """Returns, for each recognizer, a digest of everything the rows of
+           the placement matrix down to its last row (after the gap moves)
+           depend on: the recognizer lengths (the gap scores and the feasible
+           columns depend on all of them), the PSSMs up to that recognizer,
+           and the connectors up to the one that follows it.
+        """
+        plan = self.placement_plan
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array(plan.recog_lengths, dtype=np.int64).tobytes())
+        prefix_fingerprints = []
+        for recog_idx, recog_fingerprint in enumerate(plan.recog_fingerprints):
+            digest.update(recog_fingerprint)
+            if recog_idx < len(self.connectors):
+                digest.update(self.connectors[recog_idx].get_fingerprint())
+            prefix_fingerprints.append(digest.copy().digest())
+        return prefix_fingerprints
+    
+    def get_cached_energies(self, seq_ids) -> np.ndarray:
+        """Returns the energies of the organism on the sequences with the
+           given IDs stored in the energy memo, as an array (NaN for the
+           sequences that are not in the memo).
+        """
+        return energy_memo.get_energies(self.get_genome_fingerprint(), seq_ids)
+    
+    def get_cached_band_cutoffs(self, seq_ids) -> np.ndarray:
+        """Returns the band cutoff flags stored in the energy memo with the
+           energies of the organism on the sequences with the given IDs (False
+           for the sequences that are not in the memo).
+        """
+        return energy_memo.get_band_cutoffs(self.get_genome_fingerprint(), seq_ids)
+    
+    def set_cached_energies(self, seq_ids, energies, band_cutoffs=None) -> None:
+        """Stores the energies of the organism on the sequences with the
+           given IDs in the energy memo, with their band cutoff flags (see
+           get_energies).
+        """
+        energy_memo.set_energies(self.get_genome_fingerprint(), seq_ids,
+                                 energies, band_cutoffs)
+    
+    def apply_energy_threshold(self, energies) -> np.ndarray:
+        """Applies the lower bound to an array of energies, as done by
+           set_placement_energy (energies are returned unchanged if the energy
+           threshold method is not "organism").
+        """
+        if self.energy_threshold_method == "organism":
+            return np.where(energies < self.energy_threshold_value,
+                            self.energy_threshold_value, energies)
+        return energies
+    
+    def get_energy_upper_bounds(self, seq_lengths) -> np.ndarray:
+        """Returns an upper bound of the energy of the organism on sequences
+           of the given lengths, as an array. A placement scores each PSSM
+           column once and each connector once (with a gap of 0 bp or more),
+           so the energy is at most the sum of the best score of each PSSM
+           column plus the best score of each connector among all the gap
+           sizes observable on a sequence of that length. The lower bound of
+           get_energies is applied.
+        """
+        seq_lengths = np.asarray(seq_lengths)
+        pssm_bound = self.placement_plan.pssm_scores[1:].max(axis=1).sum()
+        bounds = np.empty(len(seq_lengths))
+        for length in np.unique(seq_lengths):
+            bounds[seq_lengths == length] = (
+                pssm_bound + self.get_connectors_upper_bound(int(length)))
+        return self.apply_energy_threshold(bounds)
+    
+    def get_connectors_upper_bound(self, seq_length) -> float:
+        """Returns the sum of the best score of each connector among all the
+           gap sizes observable on a sequence of the given length.
+        """
+        bound = 0.0
+        for connector in self.connectors:
+            gap_scores = connector.gap_scores(seq_length, self.placement_plan.recog_lengths)
+            bound += gap_scores.max() if len(gap_scores) > 0 else -1 * np.inf
+        return bound
+    
+    def get_suffix_upper_bounds(self, seq_codes, seq_ids=None) -> list:
+        """Returns, for each recognizer but the last one, an upper bound of
+           the score of the rest of a placement (the recognizers after it,
+           and the connectors after the one that follows it) when the next
+           recognizer starts on each column j of the sequence, as an array
+           with the shape of the rows of the placement matrix.
+           
+           The bounds are filled backwards, recognizer by recognizer: the
+           bound when recognizer r starts on column j is its score on the
+           window starting there, plus the best bound of its connector and
+           recognizer r+1 after the window. Gaps of 0 bp are scored exactly,
+           and longer ones by buckets of sizes around the mode of the
+           connector (see gap_transition.get_gap_upper_bounds), applied
+           from right to left.
+           
+           seq_codes can also be a 2D array with a batch of encoded sequences
+           of the same length (one per line). If the IDs of the sequences are
+           given, the PSSM scans are read from (and stored in) the scan cache.
+        """
+        plan = self.placement_plan
+        n = seq_codes.shape[-1]
+        batch = seq_codes.reshape(-1, n)
+        suffix_bounds = []
+        
+        # Bound of the rest of the placement after the end of each window
+        # of the recognizer (0 after the last one)
+        bound = np.zeros((len(batch), n+1))
+        for recog_idx in range(len(plan.recog_lengths) - 1, 0, -1):
+            length = plan.recog_lengths[recog_idx]
+            window_bounds = np.full((len(batch), n+1), -1 * np.inf)
+            if length <= n:
+                window_bounds[:, :n-length+1] = get_window_scores(
+                    plan.pssm_scores[plan.recog_first_rows[recog_idx]:
+                                     plan.recog_last_rows[recog_idx] + 1],
+                    plan.recog_fingerprints[recog_idx], batch,
+                    seq_ids) + bound[:, length:]
+            suffix_bounds.append(window_bounds.reshape(seq_codes.shape[:-1] + (n+1,)))
+            
+            # Bound of the connector before the recognizer and the rest of
+            # the placement, when the gap starts on each column
+            gap_scores = self.connectors[recog_idx - 1].gap_scores(n, plan.recog_lengths)
+            if len(gap_scores) == 0:
+                bound = np.full((len(batch), n+1), -1 * np.inf)
+                continue
+            buckets = get_size_buckets(1, len(gap_scores) - 1,
+                                       int(np.argmax(gap_scores[1:])) + 1)
+            bound = np.maximum(
+                window_bounds + gap_scores[0],
+                get_gap_upper_bounds(window_bounds[:, ::-1], gap_scores,
+                                     buckets)[:, ::-1])
+        return suffix_bounds[::-1]
+    
+    def is_below_energy_threshold(self, seq_codes, seq_ids=None) -> np.ndarray:
+        """Returns, for each sequence of a batch of encoded sequences of the
+           same length (one per line), whether the energy of the organism on
+           it is sure to be raised to the threshold by the lower bound of
+           get_energies (never, if the energy threshold method is not
+           "organism"). Those energies don't need a placement.
+           
+           The bound for the length of the sequences (see
+           get_energy_upper_bounds) is checked first. If it's above the
+           threshold, it's refined on each sequence by replacing the best
+           score of each PSSM column with the best score of each PSSM on any
+           window of the sequence. The PSSM scans are read from (and stored
+           in) the scan cache if the IDs of the sequences are given.
+        """
+        n_seqs, n = seq_codes.shape
+        below = np.zeros(n_seqs, dtype=bool)
+        if self.energy_threshold_method != "organism" or n_seqs == 0:
+            return below
+        threshold = self.energy_threshold_value
+        if self.get_energy_upper_bounds([n])[0] <= threshold:
+            below[:] = True
+            return below
+        
+        plan = self.placement_plan
+        if max(plan.recog_lengths) > n:
+            return below
+        bounds = np.full(n_seqs, self.get_connectors_upper_bound(n))
+        for recog_idx in range(len(plan.recog_lengths)):
+            window_scores = get_window_scores(
+                plan.pssm_scores[plan.recog_first_rows[recog_idx]:
+                                 plan.recog_last_rows[recog_idx] + 1],
+                plan.recog_fingerprints[recog_idx], seq_codes, seq_ids)
+            bounds += window_scores.max(axis=1)
+        return bounds <= threshold
+    
+    def fill_recognizer_rows(self, seq_codes, seq_ids=None, traceback=False):
+        """Fills the last row of each PSSM of the placement matrix, PSSM by
+           PSSM (see get_placement).
+           
+           Returns the bottom row of the matrix, whether the band of the
+           banded mode may have cut off the optimum (for each sequence of a
+           batch) and, if traceback is True, the rows needed to trace back
+           the placement: the last row of each PSSM before (diag_rows) and
+           after (final_rows) the gap moves, where element 0 is the first
+           row of the matrix, and the gap pointers. Otherwise, only the rows
+           of the current PSSM are kept during the fill, and None is
+           returned instead.
+           
+           seq_codes can also be a 2D array with a batch of encoded sequences
+           of the same length (one per line). Each row then becomes a 2D
+           array, with the row of each sequence on the same line. If the IDs
+           of the sequences of the batch are given, the PSSM scans are read
+           from (and stored in) the scan cache.
+           
+           In banded mode, an influence row bounds, on each row, the scores
+           of the placements with a gap outside the band (see
+           get_influence_row). Without the band, the energy can only change
+           if one of those placements scores as much as the energy, or if
+           one of them reaches a cell of the optimal banded placement with a
+           score at least as good as the banded one: the cell may then be
+           reached with another move, and lose (or get) the 0-bp gap score
+           of the next connector. The cells that may be on the optimal
+           banded placement are found with get_suffix_upper_bounds. The band
+           may have cut off the optimum when either happens.
+        """
+        plan = self.placement_plan
+        n = seq_codes.shape[-1]
+        rows_shape = seq_codes.shape[:-1] + (n+1,)
         
-        # Set the total binding energy in the placement object
-        # Applying lower bound to energy if required
+        # First row is set to zeros
+        final_row = np.zeros(rows_shape)
+        came_diagonally = np.zeros(rows_shape, dtype=bool)
+        if traceback:
+            diag_rows = [final_row]
+            final_rows = [final_row]
+            gap_pointers = {}
+        
+        # Influence row, and best bound of the placements that the band may
+        # have cut off or changed
+        banded = any(connector.get_gap_band() is not None
+                     for connector in self.connectors)
+        if banded:
+            influence_row = np.full(rows_shape, -1 * np.inf)
+            cutoff_bound = np.full(seq_codes.shape[:-1], -1 * np.inf)
+            suffix_bounds = self.get_suffix_upper_bounds(seq_codes, seq_ids)
+        
+        for recog_idx, length in enumerate(plan.recog_lengths):
+            first_row = plan.recog_first_rows[recog_idx]
+            last_row = plan.recog_last_rows[recog_idx]
+            
+            # Scan the PSSM across the sequence (windows starting at s, on
+            # the feasible columns of the previous row, up to N-L), and place
+            # it after the previous row
+            diag_row = np.full(rows_shape, -1 * np.inf)
+            influence_diag = np.full(rows_shape, -1 * np.inf)
+            first_window, last_window = plan.get_feasible_columns(first_row - 1, n)
+            n_windows = min(last_window, n - length) - first_window + 1
+            if n_windows > 0:
+                zero_gap_terms = self.get_zero_gap_terms(first_row, came_diagonally)
+                windows = slice(first_window, first_window + n_windows)
+                if seq_ids is None:
+                    window_scores = None
+                    for c in range(length):
+                        window_scores = self.extend_window_scores(
+                            first_row + c, c, seq_codes, window_scores,
+                            first_window, n_windows)
+                else:
+                    window_scores = get_window_scores(
+                        plan.pssm_scores[first_row:last_row + 1],
+                        plan.recog_fingerprints[recog_idx], seq_codes,
+                        seq_ids)[:, windows]
+                diag_row[..., first_window+length:first_window+length+n_windows] = (
+                    final_row[..., windows] + (zero_gap_terms[..., windows] + window_scores))
+                if banded:
+                    influence_diag[..., first_window+length:first_window+length+n_windows] = (
+                        influence_row[..., windows] +
+                        (max(self.get_zero_gap_score(first_row, n), 0) + window_scores))
+            
+            # Gap moves
+            final_row, came_diagonally, gap_origins = self.apply_gap_moves(
+                last_row, diag_row)
+            if banded:
+                influence_row = self.get_influence_row(last_row, diag_row,
+                                                       influence_diag)
+                if plan.is_gap_row(last_row):
+                    # Cells where a placement with a gap outside the band
+                    # may replace the banded move
+                    replaced = np.isfinite(final_row) & (influence_row >= final_row)
+                    zero_gap_score = self.connectors[
+                        plan.gap_connector_idx[last_row]].gap_scores(
+                            n, plan.recog_lengths)[0]
+                    cutoff_bound = np.maximum(cutoff_bound, np.where(
+                        replaced,
+                        final_row + max(zero_gap_score, 0) + suffix_bounds[recog_idx],
+                        -1 * np.inf).max(axis=-1))
+            if traceback:
+                diag_rows.append(diag_row)
+                final_rows.append(final_row)
+                if gap_origins is not None:
+                    gap_pointers[last_row] = gap_origins.astype(np.int32)
+        
+        band_cutoff = np.zeros(seq_codes.shape[:-1], dtype=bool)
+        if banded:
+            cutoff_bound = np.maximum(cutoff_bound, influence_row.max(axis=-1))
+            band_cutoff = np.isfinite(cutoff_bound) & (
+                cutoff_bound >= self.apply_energy_threshold(final_row.max(axis=-1)))
+        if not traceback:
+            return final_row, band_cutoff, None
+        return final_row, band_cutoff, (diag_rows, final_rows, gap_pointers)
+    
+    def set_placement_energy(self, placement, best) -> None:
+        """Sets the energy of the placement to the given best energy,
+           applying the lower bound to energy if required
+        """
         if self.energy_threshold_method == "organism":
             E_threshold_value = self.energy_threshold_value
             if best < E_threshold_value:
                 placement.set_energy(E_threshold_value)
             else:
                 placement.set_energy(best)
+    
+    def set_placement_nodes(self, placement, seq_codes, diag_rows, final_rows,
+                            gap_pointers) -> None:
+        """Traces back the best placement, and sets the scores and the
+           positions of all the nodes of the organism in the placement object.
+           diag_rows and final_rows are the last rows of each PSSM, before and
+           after the gap moves (element 0 is the first row of the matrix).
+        """
+        # Position of best (where backtracking starts from)
+        last_row = final_rows[-1]
+        best = last_row.max()
+        best_i = self.placement_plan.n_rows  # it always comes from the last row by definition
+        # if multiple positions in last row have best value, pick first
+        # to initiate traceback
+        best_j = int(np.where(last_row == best)[0][0])  # column of best value
+        
+        # Traverse back the matrix from the best element in the last row
+        # and store the alignment path (top-down, as a Kx2 array of cells)
+        alignment_path = self.traverse_matrix(gap_pointers, best_i, best_j)
+        
+        # Get scores and positions of all the nodes of the organism
+        node_scores, node_pos_ends, cols_of_0_gaps = self.get_node_positions_and_energies(
+            alignment_path, diag_rows, final_rows, gap_pointers, seq_codes
+        )
+
+        # Split node-scores into recognizers-scores and connectors-scores
+        # Remove token node [first row is treated as a node, to provide
+        # a start position for the following recognizer, by tracking its
+        # end]
+        node_scores = node_scores[1:]  
+        recognizers_scores = []
+        connectors_scores = []
+        for i in range(len(node_scores)):
+            if i % 2 == 0:
+                recognizers_scores.append(node_scores[i])
+            else:
+                connectors_scores.append(node_scores[i])
         
+        # Set the individual node energies in the placement object
+        placement.set_recognizer_scores(recognizers_scores)
+        placement.set_connectors_scores(connectors_scores)
         
-        if traceback:
-            # Position of best (where backtracking starts from)
-            best_i = m  # it always comes from the last row by definition
-            # if multiple positions in last row have best value, pick first
-            # to initiate traceback
-            best_j = int(np.where(last_row == best)[0][0])  # column of best value
-            
-            # Traverse back the matrix from the best element in the last row
-            # and store the alignment path
-    		# traverse_matrix is a recursive function that will generate the path
-    		# taken by the optimal alignment
-            alignment_path = []
-            alignment_path = self.traverse_matrix(pointers_matrix, best_i, best_j, alignment_path)
-            alignment_path.reverse()  # Top-down instead of bottom-up
+        # Annotate where each node is placed (start and stop position on DNA)
+        # in the placement object
+        
+        for i in range(0, len(node_pos_ends)-1):  # even indexes
             
-            # Get scores and positions of all the nodes of the organism
-            node_scores, node_pos_ends, cols_of_0_gaps = self.get_node_positions_and_energies(
-                alignment_path, scores_matrix, pointers_matrix, dna_sequence
-            )
-
-            # Split node-scores into recognizers-scores and connectors-scores
-            # Remove token node [first row is treated as a node, to provide
-            # a start position for the following recognizer, by tracking its
-            # end]
-            node_scores = node_scores[1:]  
-            recognizers_scores = []
-            connectors_scores = []
-            for i in range(len(node_scores)):
-                if i % 2 == 0:
-                    recognizers_scores.append(node_scores[i])
-                else:
-                    connectors_scores.append(node_scores[i])
+            # get sequence coordinates for the recognizer
+            start = node_pos_ends[i]
+            stop = node_pos_ends[i+1]
             
-            # Set the individual node energies in the placement object
-            placement.set_recognizer_scores(recognizers_scores)
-            placement.set_connectors_scores(connectors_scores)
+            # Detect a post 0-bp gap recognizer (special case)
+            if start in cols_of_0_gaps:
+                start -= 1
             
-            # Annotate where each node is placed (start and stop position on DNA)
-            # in the placement object
+            # Define position of the node on DNA as a tuple
+            node_position = (start, stop)
             
-            for i in range(0, len(node_pos_ends)-1):  # even indexes
-                
-                # get sequence coordinates for the recognizer
-                start = node_pos_ends[i]
-                stop = node_pos_ends[i+1]
-                
-                # Detect a post 0-bp gap recognizer (special case)
-                if start in cols_of_0_gaps:
-                    start -= 1
-                
-                # Define position of the node on DNA as a tuple
-                node_position = (start, stop)
-                
-                if i % 2 == 0:
-                    placement.append_recognizer_position(node_position)
-                else:
-                    placement.append_connector_position(node_position)
+            if i % 2 == 0:
+                placement.append_recognizer_position(node_position)
+            else:
+                placement.append_connector_position(node_position)
         
-        return placement
     
-    def get_additive_fitness(self, a_dna: list) -> dict:
+    def get_additive_fitness(self, a_dna: list, energies=None) -> dict:
         """
 
         Args:
             a_dna: list of dna sequences
+            energies: energies of the organism on the sequences, if already
+                      computed (e.g. by a population-level call)
 
         Returns:
             average/sum of the energy of the organism on the sequences
         """
 
-        scores = []
-		# for each sequence in the provided sequence set
-        for s_dna in a_dna:
-            placement = self.get_placement(s_dna)
-            energy = placement.energy  # energy          
-            scores.append(energy)
+        # energy of the organism on each sequence in the provided set
+        scores = self.get_energies(a_dna) if energies is None else energies
         
         score_stdev = np.std(scores)
-        if self.cumulative_fit_method == "sum":
-            # Compute fitness score as sum over the positive scores
-            score = np.sum(scores)
-        
-        elif self.cumulative_fit_method == "mean":
-            # Compute fitness score as average positive score
-            score = np.mean(scores)
-            
-        elif self.cumulative_fit_method == "median":
-            # Compute fitness score as median positive score
-            score = np.median(scores)
+        # Sum, average or median score (see fitness_functions)
+        score = get_cumulative_scores(np.array([scores]),
+                                      [self.cumulative_fit_method])[0]
         
         return {"score": score, "stdev" : score_stdev}
     
@@ -929,17 +1265,14 @@ class OrganismObject:
             list of binding eneregies
         """
 
-        binding_energies = []
-		# for each sequence in the provided sequence set
-        for s_dna in a_dna:
-            placement = self.get_placement(s_dna)
-            energy = placement.energy
-            binding_energies.append(energy)
+        # energy of the organism on each sequence in the provided set
+        binding_energies = list(self.get_energies(a_dna))
         
         return binding_energies
 
     def get_kolmogorov_fitness(self, pos_dataset: list, neg_dataset: list,
-                               traceback=False) -> float:
+                               traceback=False, pos_energies=None,
+                               neg_energies=None) -> float:
         """Returns the organism's fitness, defined as the Kolmogorov-Smirnov
            test statistic. This is bounded in [0,1].
            Test null assumes the samples are drawn from the same (continuous)
@@ -949,28 +1282,26 @@ class OrganismObject:
         Args:
             pos_dataset: list of dna sequences in the positive dataset
             neg_dataset: list of dna sequences in the negative dataset
+            pos_energies, neg_energies: energies of the organism on the
+                                        datasets, if already computed
         Returns:
             fitness assigned to the organism
         """       
         # Values on the positive set
-        pos_values = []
-        for s_dna in pos_dataset:
-            placement = self.get_placement(s_dna)
-            pos_values.append(placement.energy)  # append sequence energy score
+        pos_values = self.get_energies(pos_dataset) if pos_energies is None else pos_energies
         
         # Values on the negative set
-        neg_values = []
-        for s_dna in neg_dataset:
-            placement = self.get_placement(s_dna)
-            neg_values.append(placement.energy)  # get sequence energy score
+        neg_values = self.get_energies(neg_dataset) if neg_energies is None else neg_energies
         
-        # Compute fitness score as a Boltzmannian probability
-        kolmogorov_fitness = ks_2samp(pos_values, neg_values).statistic
+        # Compute fitness score as the Kolmogorov-Smirnov statistic
+        kolmogorov_fitness = get_ks_statistics(np.array([pos_values]),
+                                               np.array([neg_values]))[0]
         
         return {"score": kolmogorov_fitness}
     
     def get_boltz_fitness(self, pos_dataset: list, neg_dataset: list,
-                          genome_length: int) -> float:
+                          genome_length: int, pos_energies=None,
+                          neg_energies=None) -> float:
         """Returns the organism's fitness, defined as the probability that the regulator binds a
         positive sequence. All the binding energies are turned into probabilities according to a
         Boltzmannian distribution. The probability of binding a particular sequence, given the binding
@@ -985,36 +1316,21 @@ class OrganismObject:
             pos_dataset: list of dna sequences in the positive dataset
             neg_dataset: list of dna sequences in the negative dataset
             genome_length: integer representing the length of the genome
+            pos_energies, neg_energies: energies of the organism on the
+                                        datasets, if already computed
 
         Returns:
             fitness assigned to the organism
         """
-        
-        # Values on the positive set
-        pos_values = []
-        for s_dna in pos_dataset:
-            placement = self.get_placement(s_dna)
-            boltz_exp = np.e**placement.energy  # exp(energy)
-            pos_values.append(boltz_exp)
-        
-        # Values on the negative set
-        neg_values = []
-        neg_lengths = []
-        for s_dna in neg_dataset:
-            placement = self.get_placement(s_dna)
-            boltz_exp = np.e**placement.energy  # exp(energy)
-            neg_values.append(boltz_exp)
-            neg_lengths.append(len(s_dna))
-        
-        # Scaling factor, used to over-represent the negative scores, so that
-        # it simulates a genome of specified length
-        neg_factor = genome_length//sum(neg_lengths)
-        
-        # Partition function
-        Z = sum(pos_values) + neg_factor * sum(neg_values)
+        if pos_energies is None:
+            pos_energies = self.get_energies(pos_dataset)
+        if neg_energies is None:
+            neg_energies = self.get_energies(neg_dataset)
         
         # Compute fitness score as a Boltzmannian probability
-        boltz_fitness = sum(pos_values) / Z
+        boltz_fitness = get_boltzmann_probabilities(
+            np.array([pos_energies]), np.array([neg_energies]),
+            [len(s_dna) for s_dna in neg_dataset], genome_length)[0]
         
         return {"score": boltz_fitness}
 
@@ -1055,77 +1371,187 @@ class OrganismObject:
         
         return sum_lengths
     
-    def get_gap_score(self, connector_idx, d, s_dna_len):
-        """Calls the appropriate connector, with the given distance and length of the DNA sequence to
-		   obtain the energy of the connector.
-		"""
-        if d < s_dna_len:
-            # !!! New input param for connector.get_score: the list of the lengths of the recognizers
-            recog_lengths = [recog.length for recog in self.recognizers]
-            gap_score = self.connectors[connector_idx].get_score(d, s_dna_len, recog_lengths)
-            return gap_score
-        else:
-            return -1 * np.inf
-    
-    def get_score_from_pssm(self, row_idx_from_placement_matrix, nucleotide):
-        """Calls the appropriate PSSM (and column) to obtain the score, given a nucleotide
+    def get_score_from_pssm(self, row_idx_from_placement_matrix, base_idx):
+        """Reads the score of the PSSM (and column) mapped on the row, given a
+           nucleotide encoded as a base index (a=0, c=1, g=2, t=3)
 		"""
-        pssm_index = self.row_to_pssm[row_idx_from_placement_matrix][0]
-        pssm_column = self.row_to_pssm[row_idx_from_placement_matrix][1]
-        pssm_object = self.recognizers[pssm_index]
-        score = pssm_object.pssm[pssm_column][nucleotide]
-        return score
+        return self.placement_plan.pssm_scores[row_idx_from_placement_matrix, base_idx]
     
-    def get_diag_score(self, pointers_mat, row_idx, col_idx, dna_sequence):
-        """Evaluates and returns a substitution score (diagonal move), using
-		   get_score_from_pssm and taking into account several special cases.
-		   row_idx and col_idx identify the "destination" cell [the cell being
-		   evaluated]
-		"""
+    def get_zero_gap_terms(self, first_row, came_diagonally):
+        """Returns the 0-bp gap scores to be added to the cells of the first
+           row of a PSSM, indexed by the column s of their diagonal-up-left
+           cell. The PSSM follows the previous one with a gap of 0 bp when
+           that cell (on the last row of the previous PSSM) was reached with
+           a diagonal move (came_diagonally): the score of the connector for
+           a 0-bp gap applies there, and 0 elsewhere.
+        """
+        n = came_diagonally.shape[-1] - 1
+        if not came_diagonally.any():
+            return np.zeros(came_diagonally.shape)
+        return np.where(came_diagonally, self.get_zero_gap_score(first_row, n), 0.0)
     
-        diag_score = 0
-        
-        # Check if it is a gap of zero bp
-		# This means two PSSMs back to back, which then must incorporate a zero
-		# gap score
-        if self.is_a_0_bp_gap(pointers_mat, row_idx, col_idx):
-            # Call connector, for a zero bp gap evaluation, add it to the
-			# diagonal score [connector needs to the length of the DNA seq]
-            pssm_idx = self.row_to_pssm[row_idx][0]
-            connector = self.connectors[pssm_idx - 1]
-            
-            # !!! New input param for connector.get_score: the list of the lengths of the recognizers
-            recog_lengths = [recog.length for recog in self.recognizers]
-            
-            zero_gap_score = connector.get_score(0, len(dna_sequence), recog_lengths)
-            diag_score += zero_gap_score
+    def get_zero_gap_score(self, first_row, n):
+        """Returns the 0-bp gap score of the connector before the PSSM that
+           starts on the given row, for a sequence of length n (0 for the
+           first PSSM).
+        """
+        connector_idx = self.placement_plan.zero_gap_connector_idx[first_row]
+        if connector_idx < 0:
+            return 0.0
+        connector = self.connectors[connector_idx]
+        return connector.gap_scores(n, self.placement_plan.recog_lengths)[0]
+
+    def extend_window_scores(self, row_idx, pssm_col, seq_codes, window_scores,
+                             first_window, n_windows):
+        """Adds the scores of the PSSM column mapped on the given row (the
+           pssm_col-th column of its PSSM) to the scores of n_windows
+           sequence windows, starting with the window at position
+           first_window (window s starts at sequence position s), computed up
+           to the previous PSSM column (window_scores, None for the first
+           column). PSSM scores are summed left to right.
+        """
+        start = first_window + pssm_col
+        column_scores = self.placement_plan.pssm_scores[
+            row_idx, seq_codes[..., start:start + n_windows]]
+        if window_scores is None:
+            return column_scores
+        return window_scores[..., :n_windows] + column_scores
+
+    def apply_gap_moves(self, row_idx, diag_row):
+        """Fills up the given row (the last row of a PSSM) with possible gap
+           scores (horizontal moves), if gaps are allowed on the row. The row
+           with diagonal scores is left untouched, and used as reference for
+           all the gap evaluations (no gap-to-gap moves).
+
+           Returns the row after the gap moves, the cells of the row that
+           were reached with a diagonal move, and the origin columns of the
+           gaps landing on the row (-1 where the diagonal move is kept, None
+           if the row doesn't allow gaps).
+        """
+        came_diagonally = np.ones(diag_row.shape, dtype=bool)
+        came_diagonally[..., 0] = False
         
-		# get nucleotide and compute PSSM score for it
-        nucleotide = dna_sequence[col_idx - 1] 
-        pssm_score = self.get_score_from_pssm(row_idx, nucleotide)
-        diag_score += pssm_score
+        if not self.placement_plan.is_gap_row(row_idx):
+            return diag_row, came_diagonally, None
         
-        return diag_score
-    
+        gap_scores, gap_origins = self.get_gap_scores_row(
+            row_idx, diag_row)
+        gap_won = gap_origins >= 0
+        
+        # Update the row where a gap is the best move
+        row = diag_row.copy()
+        row[gap_won] = gap_scores[gap_won]
+        came_diagonally[gap_won] = False
+        
+        return row, came_diagonally, gap_origins
+
+    def get_gap_scores_row(self, row_idx, diag_row):
+        """Evaluates the horizontal moves (gaps) landing on the given row.
+           Every gap is scored by the connector following the PSSM that ends
+           on this row, and added to the diagonal score of its origin cell.
+           Gaps that can't be the best ones are skipped (see gap_transition).
+
+           In banded mode (PLACEMENT_BAND_SIGMAS set in the connector
+           configuration) only the gap sizes within the band of the connector
+           (mu +/- k*sigma) are evaluated.
+
+           Returns the best gap score landing on each column, and the origin
+           column of the best gap for the columns where the gap is at least
+           as good as the diagonal move (-1 elsewhere). Among equally good
+           gaps, the one with the rightmost origin is chosen. diag_row can
+           also hold the rows of a batch of sequences of the same length (see
+           fill_recognizer_rows).
+        """
+        n = diag_row.shape[-1] - 1
+        connector = self.connectors[self.placement_plan.gap_connector_idx[row_idx]]
+        band = connector.get_gap_band()
+        min_size, max_size = (1, n) if band is None else band
+
+        # Connector score for each gap size, looked up in the table of the
+        # connector (gaps as long as the sequence are scored -inf)
+        gap_scores_by_size = np.full(n+1, -1 * np.inf)
+        gap_scores_by_size[1:n] = connector.gap_scores(
+            n, self.placement_plan.recog_lengths)[1:n]
+
+        # Best gap landing on each feasible column (see gap_transition). Gaps
+        # are confined to the feasible columns of the row: gaps from (or to)
+        # other columns can't be on a complete placement.
+        first_col, last_col = self.placement_plan.get_feasible_columns(row_idx, n)
+        best_gap_scores = np.full(diag_row.shape, -1 * np.inf)
+        best_origins = np.full(diag_row.shape, -1, dtype=np.int64)
+        if last_col >= first_col:
+            feasible = slice(first_col, last_col + 1)
+            window_gap_scores, window_origins = gap_transition(
+                diag_row[..., feasible], gap_scores_by_size[:last_col - first_col + 1],
+                min_size, max_size)
+            best_gap_scores[..., feasible] = window_gap_scores
+            best_origins[..., feasible] = np.where(window_origins >= 0,
+                                                   window_origins + first_col, -1)
+
+        # Gaps replace diagonal moves when they are at least as good
+        gap_won = best_gap_scores >= diag_row
+        gap_won[..., 0] = False
+        gap_origins = np.where(gap_won, best_origins, -1)
+
+        return best_gap_scores, gap_origins
+
+    def get_influence_row(self, row_idx, diag_row, influence_diag):
+        """Returns the influence row of the given row in banded mode: for
+           each column, an upper bound of the score up to that column (after
+           the gap moves of the row) of the placements with a gap outside the
+           band, -inf if none. influence_diag bounds those placements before
+           the gap moves (their gaps on previous rows), and diag_row is the
+           row of the banded fill before the gap moves.
+
+           Rows that don't allow gaps keep influence_diag. On gap rows, the
+           gaps outside the band are bounded from diag_row, and the gaps of
+           any size from influence_diag (see get_out_of_band_bounds).
+        """
+        plan = self.placement_plan
+        if not plan.is_gap_row(row_idx):
+            return influence_diag
+
+        n = diag_row.shape[-1] - 1
+        connector = self.connectors[plan.gap_connector_idx[row_idx]]
+        band = connector.get_gap_band()
+        min_size, max_size = (1, n) if band is None else band
+        gap_scores_by_size = np.full(n+1, -1 * np.inf)
+        gap_scores_by_size[1:n] = connector.gap_scores(n, plan.recog_lengths)[1:n]
+
+        # Placements with a gap outside the band stay on the feasible columns
+        influence_row = np.full(diag_row.shape, -1 * np.inf)
+        first_col, last_col = plan.get_feasible_columns(row_idx, n)
+        if last_col >= first_col:
+            feasible = slice(first_col, last_col + 1)
+            influence_row[..., feasible] = get_out_of_band_bounds(
+                diag_row[..., feasible], influence_diag[..., feasible],
+                gap_scores_by_size[:last_col - first_col + 1],
+                min_size, max_size)
+        return influence_row
+
     def is_first(self, row_idx_from_placement_matrix):
         """Returns true if we are on the first element of a PSSM recognizer
 		"""
-        pssm_col = self.row_to_pssm[row_idx_from_placement_matrix][1]
-        if pssm_col == 0:
-            return True
-        else:
-            return False
+        return bool(self.placement_plan.is_first_row[row_idx_from_placement_matrix])
     
-    def is_last(self, row_idx_from_placement_matrix): 
-        """Returns true if we are on the last element of a PSSM recognizer
+    def get_pointer(self, gap_pointers, row_idx, col_idx):
+        """Returns the row and column of the cell from which the given cell
+           was reached, decoding the gap pointers: cells of gap rows with a
+           gap origin come from that column of the same row, and all the
+           other cells come diagonally from the up-left cell.
+           Cells of the first row and of the first column have no incoming
+           move, and (None, None) is returned.
 		"""
-		# if next one is a first, then we are at a last ;-)
-        if self.is_first(row_idx_from_placement_matrix + 1):
-            return True
-        else:
-            return False
+        if row_idx == 0 or col_idx == 0:
+            return None, None
+        
+        gap_origins = gap_pointers.get(row_idx)
+        if gap_origins is not None and gap_origins[col_idx] >= 0:
+            return row_idx, int(gap_origins[col_idx])
+        
+        return row_idx - 1, col_idx - 1
     
-    def is_a_0_bp_gap(self, pointers_mat, row_idx, col_idx):
+    def is_a_0_bp_gap(self, gap_pointers, row_idx, col_idx):
         """Tells whether the cell defines a contiguous diagonal
 		   run between two PSSMs
 		"""
@@ -1138,7 +1564,7 @@ class OrganismObject:
 		# get row index of diagonal-up-left cell
 		# this should be the row of the cell pointing to the
 		# end of the previous PSSM
-        pointer_row_idx = pointers_mat[0][row_idx-1, col_idx-1]
+        pointer_row_idx, _ = self.get_pointer(gap_pointers, row_idx-1, col_idx-1)
         
 		# the equality below, will only be true, if there was
 		# a diagonal move. this, combined with the fact that we know
@@ -1150,123 +1576,124 @@ class OrganismObject:
         else:
             return False
     
-    def traverse_matrix(self, pointers_mat, i, j,
-                        alignment_path=[], from_gap_flag=False) -> list:
-        """Recursive function used for traceback
-		   - i and j are the starting positions
-		   - alignment_path is the path that is filled up recursively
-		   - from_gap_flag identifies the case that we got to this position from a gap
-		     and we therefore MUST go diagonal (no gap concatenation is allowed)
+    def traverse_matrix(self, gap_pointers, i, j) -> np.ndarray:
+        """Iterative traceback, starting from cell (i, j).
+           Returns the alignment path as a Kx2 array with the row and column
+           of each cell, top-down (the first cell is on the first row).
+
+           Between gap rows all the moves are diagonal, so the path is built
+           by diagonal runs that end on the next gap row, where the gap
+           pointers are read. When a gap is taken, the next move MUST be
+           diagonal (no gap concatenation is allowed).
+           A run also ends on the first row and on the first column, where
+           cells have no incoming move.
 		"""
-        
-        # End of the recursion
-        if i == None:  # the top row has been reached
-            return alignment_path
-        
-		# add current cell coordinates to path
-        alignment_path.append([i,j])
-        
-		# avoid double gaps
-        if from_gap_flag == True:
-            # move diagonally
-            i_next = i - 1
-            j_next = j - 1
-	    # or move back through annotated pointer
-        else:
-            # move where the pointers-matrix says
-            i_next = pointers_mat[0, i, j]
-            j_next = pointers_mat[1, i, j]
-        
-		# if moving horizontally, indicate that with flag
-        if i_next == i:
-            return self.traverse_matrix(pointers_mat, i_next, j_next,
-                                        alignment_path, from_gap_flag=True)
-        else:
-            return self.traverse_matrix(pointers_mat, i_next, j_next,
-                                        alignment_path,from_gap_flag=False)
+        gap_rows = sorted(gap_pointers)
+        runs = []
+        from_gap_flag = False
+        
+        while True:
+            # Last row of the diagonal run starting at (i, j): the next gap
+            # row whose pointer must be read (the current row is skipped if we
+            # got here from a gap), or the first row/column if reached before
+            n_gap_rows_above = bisect.bisect_left(gap_rows, i) if from_gap_flag \
+                else bisect.bisect_right(gap_rows, i)
+            run_end = gap_rows[n_gap_rows_above - 1] if n_gap_rows_above > 0 else 0
+            run_end = max(run_end, i - j)
+            
+            # Add the run to the path
+            run_rows = np.arange(i, run_end - 1, -1)
+            runs.append(np.column_stack((run_rows, run_rows - (i - j))))
+            i, j = run_end, j - (i - run_end)
+            
+            # The top row (or the first column) has been reached
+            if i == 0 or j == 0:
+                break
+            
+            # move where the gap pointers say
+            i_next, j_next = self.get_pointer(gap_pointers, i, j)
+            # if moving horizontally, indicate that with flag
+            from_gap_flag = (i_next == i)
+            i, j = i_next, j_next
+        
+        # Top-down instead of bottom-up
+        return np.concatenate(runs)[::-1]
 
-    
-    def get_node_positions_and_energies(self, alignment_path, scores_matrix,
-                                        pointers_matrix, dna_seq) -> list:
-        """Takes the alignment path and the completed score and pointer matrices.
+    def get_node_positions_and_energies(self, alignment_path, diag_rows,
+                                        final_rows, gap_pointers, dna_seq) -> list:
+        """Takes the alignment path, the last rows of each PSSM before
+           (diag_rows) and after (final_rows) the gap moves, and the gap
+           pointers.
            Returns a list that contains:
            - node_scores: score of recognizer/connector node
            - node_placements_right_ends: column of matrix where placement of node ends
            - columns_of_0_bp_gaps: column with special contiguous recognizer case
            
-           The alignment path is already reversed, so first element is top-left.
+           The alignment path is a Kx2 array of cells, already top-down, so
+           first element is top-left.
            
-           Function goes through the alignment path and reports where each node
-           ends (column in alingment matrix)
+           Function reports where each node ends (column in alignment matrix)
+           and the cumulative score at that point. Nodes end on the cells of
+           the path that are on a row where gaps are allowed (PSSM ends or
+           connectors), and on the cells where a PSSM follows the previous
+           one with a gap of 0 bp. Node scores are the differences between
+           consecutive cumulative scores.
 		"""
         
-        # Use the path to get info about individual positions and score of all the
-        # nodes of the organism
-        
-        node_scores = []
-        previous_score = 0
-        node_placements_right_ends = []
-        previous_element = [None, None]
-        columns_of_0_bp_gaps = []
-        
-        # for each element of the alignment path
-        for element in alignment_path:
-            row, column = element
-            
-            # if we are on a row where gaps are allowed (PSSM ends or connector)
-            if self.is_last(row):
-                
-                # if we just landed on this row via a diagonal move, then 
-                # this is a PSSM end
-                if previous_element[0] == row - 1:
-                    # The PSSM score needs to be recomputed (it could have been
-                    # over-written by a gap-score)
-                    
-                    score = self.get_diag_score(pointers_matrix, row,
-                                                         column, dna_seq)
-                    cumulative_score = scores_matrix[row-1, column-1] + score
-                
-                # this was a gap, so no need to recompute score
-                else:
-                    cumulative_score = scores_matrix[row, column]
-                
-                # compute the node score, by substracting from cumulative
-                node_score = cumulative_score - previous_score
-                node_scores.append(node_score)
-                previous_score = cumulative_score
-                
-                # mark its last position on matrix (right end)
-                node_placements_right_ends.append(column)
-                
-            # if we are on the first position of a new pssm which is adjacent to
-            # the previous one (gap of 0 bp), the cumulative score we read also
-            # contains the score of the first position of the PSSM (not only the
-            # connector score)
-            if self.is_a_0_bp_gap(pointers_matrix, row, column):
-                
-                
-                nucleotide = dna_seq[column - 1] 
-                pssm_contribution = self.get_score_from_pssm(row, nucleotide)
-                
-                
-                cell_score = scores_matrix[row, column]
-                # Remove the pssm contribution, so that the cumulative score
-                # doesn't include the first position of the next PSSM, but only the
-                # contribution from the connector
-                cumulative_score = cell_score - pssm_contribution
-                node_score = cumulative_score - previous_score
-                node_scores.append(node_score)
-                previous_score = cumulative_score
-                
-                node_placements_right_ends.append(column)
-                
-                columns_of_0_bp_gaps.append(column)
-            
-            
-            previous_element = [row, column]
-            
-        
-        return [node_scores, node_placements_right_ends, columns_of_0_bp_gaps]
+        plan = self.placement_plan
+        rows = alignment_path[:, 0]
+        cols = alignment_path[:, 1]
+        
+        # Index of the last rows in diag_rows/final_rows (the PSSM index + 1,
+        # and 0 for the first row of the matrix)
+        last_row_idx = plan.row_pssm_idx[:-1] + 1
+        
+        # Cells landed on via a diagonal move
+        diag_arrivals = np.zeros(len(rows), dtype=bool)
+        diag_arrivals[1:] = rows[:-1] == rows[1:] - 1
+        
+        # Cells on a row where gaps are allowed (PSSM ends or connector).
+        # if we just landed on this row via a diagonal move, then this is a
+        # PSSM end, and its score is the one before the gap moves (it could
+        # have been over-written by a gap-score)
+        ends_idx = np.flatnonzero(plan.is_last_row[rows])
+        ends_cumulative_scores = np.array(
+            [(diag_rows if diag_arrivals[k] else final_rows)[last_row_idx[rows[k]]][cols[k]]
+             for k in ends_idx], dtype=float)
+        
+        # if we are on the first position of a new pssm which is adjacent to
+        # the previous one (gap of 0 bp), the cumulative score we read also
+        # contains the score of the first position of the PSSM (not only the
+        # connector score)
+        zero_gaps_idx = np.array(
+            [k for k in np.flatnonzero(plan.is_first_row[rows])
+             if self.is_a_0_bp_gap(gap_pointers, rows[k], cols[k])], dtype=int)
+        zero_gaps_cumulative_scores = np.empty(len(zero_gaps_idx))
+        for k, idx in enumerate(zero_gaps_idx):
+            row, column = rows[idx], cols[idx]
+            connector = self.connectors[plan.zero_gap_connector_idx[row]]
+            zero_gap_score = connector.gap_scores(len(dna_seq), plan.recog_lengths)[0]
+            pssm_contribution = self.get_score_from_pssm(row, dna_seq[column - 1])
+            cell_score = (final_rows[plan.row_pssm_idx[row]][column - 1] +
+                          (zero_gap_score + pssm_contribution))
+            # Remove the pssm contribution, so that the cumulative score
+            # doesn't include the first position of the next PSSM, but only the
+            # contribution from the connector
+            zero_gaps_cumulative_scores[k] = cell_score - pssm_contribution
+        
+        # Merge both kinds of node ends, following the path (on the same cell,
+        # the end of a PSSM comes before the 0 bp gap)
+        order = np.argsort(np.concatenate((2 * ends_idx, 2 * zero_gaps_idx + 1)))
+        cumulative_scores = np.concatenate(
+            (ends_cumulative_scores, zero_gaps_cumulative_scores))[order]
+        node_placements_right_ends = np.concatenate(
+            (cols[ends_idx], cols[zero_gaps_idx]))[order]
+        
+        # compute the node scores, by substracting from cumulative
+        node_scores = np.diff(cumulative_scores, prepend=0)
+        
+        return [node_scores.tolist(), node_placements_right_ends.tolist(),
+                cols[zero_gaps_idx].tolist()]
     
     
     def get_random_connector(self) -> int:
@@ -1363,7 +1790,7 @@ class OrganismObject:
         ofile = open(filename, "a+")
         # for each DNA sequence
         for s_dna in a_dna:
-            placement = self.get_placement(s_dna.lower(), traceback=True)
+            placement = self.get_placement(s_dna, traceback=True)
             placement.print_placement(outfile = ofile)
         ofile.close()
 
@@ -1378,7 +1805,6 @@ class OrganismObject:
             DNA sequence and binding sites of the organisms recognizer
         """
 
-        s_dna = s_dna.lower()
-        placement = self.get_placement(s_dna.lower(), traceback=True)
+        placement = self.get_placement(s_dna, traceback=True)
         placement.print_placement(stdout = True)
 
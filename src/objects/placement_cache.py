@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Placement cache
+Stores intermediate results of the recognizer-level engine, so that the
+parts of an organism that didn't change are not computed again. The scan
+cache holds the scores of each PSSM on all the windows of each sequence,
+keyed by the fingerprint of the PSSM scores and the sequence ID: PSSMs that
+were not mutated, or that children inherit from their parents, are not
+scanned again. The frontier cache holds the rows of the placement matrix at
+the bottom of each recognizer, keyed by the fingerprint of the organism
+prefix up to that recognizer and the sequence ID, so that organisms sharing
+a prefix restart the fill below it. The size of the caches is bounded in
+bytes (least recently used entries are evicted first). The frontier cache is
+disabled (size 0) unless set_max_bytes gives it a size.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+# Default maximum size of each cache (set_max_bytes changes it)
+DEFAULT_MAX_BYTES = 2**28
+
+
+class PlacementCache:
+    """
+    Placement cache object
+
+    Entries map keys (made of fingerprints and sequence IDs, which change
+    whenever the content they refer to changes) to read-only arrays, or to
+    tuples of read-only arrays and scalars (None for missing parts), so they
+    never need to be invalidated.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        PlacementCache object constructor.
+
+        Args:
+            max_bytes: maximum total size of the arrays stored
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set_max_bytes(self, max_bytes) -> None:
+        ''' Sets the maximum total size of the arrays stored, evicting the
+        least recently used ones if needed. '''
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def get(self, key):
+        ''' Returns the entry stored with the given key (None if it's not in
+        the cache). It becomes the most recently used entry. '''
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry) -> None:
+        ''' Stores a read-only copy of the entry (an array, or a tuple of
+        arrays and scalars) with the given key, evicting the least recently
+        used entries if the cache is full. '''
+        if isinstance(entry, tuple):
+            entry = tuple(_read_only_copy(part) for part in entry)
+        else:
+            entry = _read_only_copy(entry)
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.nbytes -= _get_nbytes(previous)
+        self.entries[key] = entry
+        self.nbytes += _get_nbytes(entry)
+        self.evict()
+
+    def evict(self) -> None:
+        ''' Drops the least recently used entries above max_bytes. '''
+        while self.nbytes > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= _get_nbytes(entry)
+
+    def clear(self) -> None:
+        ''' Drops all the entries. '''
+        self.entries.clear()
+        self.nbytes = 0
+
+
+def _read_only_copy(part):
+    ''' Returns a read-only copy of an array (scalars and None are kept). '''
+    if part is None or np.isscalar(part):
+        return part
+    array = np.array(part)
+    array.flags.writeable = False
+    return array
+
+
+def _get_nbytes(entry):
+    ''' Returns the size of an entry (the arrays and scalars it holds). '''
+    if isinstance(entry, tuple):
+        return sum(_get_nbytes(part) for part in entry)
+    if entry is None:
+        return 0
+    return np.asarray(entry).nbytes
+
+
+# Caches shared by all the organisms of the process
+scan_cache = PlacementCache()
+frontier_cache = PlacementCache(max_bytes=0)
+
+
+def get_window_scores(pssm_scores, fingerprint, seq_codes, seq_ids):
+    '''
+    Returns the scores of a PSSM on all the windows of a batch of sequences
+    of the same length, as a (sequences x windows) array, where window s
+    starts at sequence position s (N-L+1 windows). PSSM scores are summed
+    left to right, as in OrganismObject.extend_window_scores.
+
+    The scans of the sequences are read from the scan cache when available,
+    and the missing ones are computed together and stored. If the IDs of the
+    sequences are not given, all the scans are computed (and not stored).
+
+    Args:
+        pssm_scores: Lx4 array with the scores of the PSSM columns
+        fingerprint: fingerprint of pssm_scores (see PlacementPlan)
+        seq_codes: 2D array of encoded sequences (one per line)
+        seq_ids: IDs of the sequences (or None)
+    '''
+    length = len(pssm_scores)
+    n_windows = seq_codes.shape[-1] - length + 1
+    window_scores = np.empty((len(seq_codes), n_windows))
+    if seq_ids is None:
+        missing = list(range(len(seq_codes)))
+    else:
+        missing = []
+        for idx, seq_id in enumerate(seq_ids.tolist()):
+            cached = scan_cache.get((fingerprint, seq_id))
+            if cached is None:
+                missing.append(idx)
+            else:
+                window_scores[idx] = cached
+
+    if missing:
+        seqs = seq_codes[missing]
+        scores = pssm_scores[0, seqs[:, :n_windows]]
+        for c in range(1, length):
+            scores = scores + pssm_scores[c, seqs[:, c:c + n_windows]]
+        window_scores[missing] = scores
+        if seq_ids is not None:
+            for idx, row in zip(missing, scores):
+                scan_cache.put((fingerprint, int(seq_ids[idx])), row)
+
+    return window_scores
@@ -34,6 +34,10 @@ class PlacementObject:
         self.connectors_scores = []
         self.recognizers_positions = []
         self.connectors_positions = []
+        
+        # True if the placement was computed in banded mode and the band may
+        # have cut off a better placement
+        self.band_cutoff = False
     
     # Compile placement features
     
@@ -46,6 +50,9 @@ class PlacementObject:
     def set_connectors_scores(self, conn_scores):
         self.connectors_scores = conn_scores
     
+    def set_band_cutoff(self, band_cutoff):
+        self.band_cutoff = band_cutoff
+    
     def append_recognizer_position(self, recog_position):
         self.recognizers_positions.append(recog_position)
     
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Placement plan object
+It compiles the structure of an organism (the mapping of its PSSM columns on
+the rows of the placement matrix) into typed arrays, read by the placement
+engines.
+"""
+
+import hashlib
+import numpy as np
+
+
+class PlacementPlan:
+    """
+    Placement plan object
+
+    Built by OrganismObject.set_row_to_pssm, from the row_to_pssm mapping and
+    the recognizers of the organism. Rows follow the placement matrix: row 0
+    is the "fake" first row, rows 1 to M map to PSSM columns, and row M+1 is
+    the token row (the first row of a non-existent next PSSM).
+
+    All the arrays are read-only: a new plan is compiled whenever the
+    organism changes.
+    """
+
+    def __init__(self, row_to_pssm, recognizers):
+        """
+        PlacementPlan object constructor.
+
+        Args:
+            row_to_pssm: list of [pssm index, pssm column] pairs for each
+                         row, including the first and token rows
+            recognizers: list of PSSM objects of the organism
+        """
+
+        # Lengths of the recognizers, and number of rows mapped to PSSMs (M)
+        self.recog_lengths = tuple(recog.length for recog in recognizers)
+        self.n_rows = sum(self.recog_lengths)
+
+        # PSSM index and PSSM column of each row (-1 for the first row, and
+        # for the PSSM index of the token row)
+        self.row_pssm_idx = np.array(
+            [-1 if pssm_idx is None else pssm_idx for pssm_idx, _ in row_to_pssm],
+            dtype=np.int64)
+        self.row_pssm_col = np.array(
+            [-1 if pssm_col is None else pssm_col for _, pssm_col in row_to_pssm],
+            dtype=np.int64)
+
+        # First and last rows of each PSSM (a row is a last row if the next
+        # one is a first row)
+        self.is_first_row = self.row_pssm_col == 0
+        self.is_last_row = self.is_first_row[1:]
+
+        # First and last row of each recognizer
+        self.recog_last_rows = np.cumsum(self.recog_lengths, dtype=np.int64)
+        self.recog_first_rows = self.recog_last_rows - self.recog_lengths + 1
+
+        # Connector scoring the gaps on each row (-1 if gaps are not allowed).
+        # Gaps are only allowed on the last row of all the PSSMs but the last
+        # one, and are scored by the connector that follows the PSSM.
+        rows = np.arange(self.n_rows + 1)
+        gap_rows = self.is_last_row & (rows >= 1) & (rows < self.n_rows)
+        self.gap_connector_idx = np.where(gap_rows, self.row_pssm_idx[:-1], -1)
+
+        # Connector scoring the 0-bp gaps landing on each row (-1 if none).
+        # 0-bp gaps land on the first row of all the PSSMs but the first one.
+        zero_gap_rows = self.is_first_row[:-1] & (self.row_pssm_idx[:-1] > 0)
+        self.zero_gap_connector_idx = np.where(zero_gap_rows,
+                                               self.row_pssm_idx[:-1] - 1, -1)
+
+        # PSSM scores as a (M+1)x4 matrix, where row i holds the scores of
+        # the PSSM column mapped on row i, for bases a, c, g and t
+        self.pssm_scores = np.zeros((self.n_rows + 1, 4))
+        for row_idx in range(1, self.n_rows + 1):
+            pssm_scores = recognizers[self.row_pssm_idx[row_idx]].pssm_scores
+            self.pssm_scores[row_idx] = pssm_scores[self.row_pssm_col[row_idx]]
+
+        # Digest of the recognizer lengths and PSSM scores: plans with the
+        # same fingerprint place the PSSMs the same way
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array(self.recog_lengths, dtype=np.int64).tobytes())
+        digest.update(self.pssm_scores.tobytes())
+        self.fingerprint = digest.digest()
+
+        # Digest of the PSSM scores of each recognizer (keys of its scans in
+        # the scan cache)
+        self.recog_fingerprints = tuple(
+            hashlib.blake2b(self.pssm_scores[first:last + 1].tobytes(),
+                            digest_size=16).digest()
+            for first, last in zip(self.recog_first_rows, self.recog_last_rows))
+
+        for array in (self.row_pssm_idx, self.row_pssm_col, self.is_first_row,
+                      self.recog_first_rows, self.recog_last_rows,
+                      self.gap_connector_idx, self.zero_gap_connector_idx,
+                      self.pssm_scores):
+            array.flags.writeable = False
+
+    def is_gap_row(self, row_idx) -> bool:
+        ''' Returns true if gaps are allowed on the given row. '''
+        return self.gap_connector_idx[row_idx] >= 0
+
+    def get_feasible_columns(self, row_idx, n):
+        '''
+        Returns the first and last columns of the given row that can be on a
+        complete placement on a sequence of length N. Reaching column j of
+        row i takes at least i bases, and the M - i rows below need at least
+        M - i more bases, so that i <= j <= N - (M - i). Cells outside this
+        window never reach the bottom row.
+
+        If the sequence is shorter than the organism (no complete placement)
+        the whole row is returned.
+        '''
+        if n < self.n_rows:
+            return 0, n
+        return int(row_idx), int(n - self.n_rows + row_idx)
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+Population placement
+Computes the energies of a group of organisms with the same structure (same
+number of recognizers and PSSM lengths) on a batch of sequences of the same
+length, filling all their placement matrices together.
+"""
+
+import numpy as np
+from .gap_transition import gap_transition, get_out_of_band_bounds
+from .placement_cache import frontier_cache, get_window_scores
+
+
+# Maximum number of cells (organisms x sequences x columns) of the rows filled
+# at once. Larger groups of organisms are split.
+MAX_BATCH_CELLS = 2**20
+
+
+def get_group_energies(organisms, seq_codes, seq_ids=None):
+    '''
+    Returns the energies (max value on the bottom row of the placement
+    matrix, without lower bound) of each organism on each sequence, as an
+    (organisms x sequences) array, and the (organisms x sequences) flags
+    telling whether the band of the banded mode may have cut off the optimum
+    (see OrganismObject.get_placement).
+
+    The organisms must share the same placement structure (the same
+    recognizer lengths), so that their placement matrices have the same
+    shape. The rows of all the matrices are filled at once, following the
+    recognizer-level engine (see OrganismObject.fill_recognizer_rows): row
+    updates run on (organisms x sequences x columns) arrays, and gap moves
+    on one line of gap scores per organism. Energies are the same as the
+    ones of OrganismObject.get_energies.
+
+    If the IDs of the sequences are given, the PSSM scans are read from (and
+    stored in) the scan cache, so that the PSSMs that didn't change are not
+    scanned again.
+
+    Args:
+        organisms: list of organisms with the same recognizer lengths
+        seq_codes: 2D array of encoded sequences of the same length (one per
+                   line)
+        seq_ids: IDs of the sequences (None to skip the scan cache)
+    '''
+    n_seqs, n = seq_codes.shape
+    batch_size = max(MAX_BATCH_CELLS // max(n_seqs * (n+1), 1), 1)
+    energies = np.empty((len(organisms), n_seqs))
+    band_cutoffs = np.zeros((len(organisms), n_seqs), dtype=bool)
+    for start in range(0, len(organisms), batch_size):
+        stop = start + batch_size
+        energies[start:stop], band_cutoffs[start:stop] = _fill_group_rows(
+            organisms[start:stop], seq_codes, seq_ids)
+    return energies, band_cutoffs
+
+
+def _fill_group_rows(organisms, seq_codes, seq_ids):
+    '''
+    Fills the placement matrices of the organisms on the sequences, and
+    returns the max value on their bottom rows and the band cutoff flags
+    (see get_group_energies).
+
+    In banded mode, the band cutoff flags are computed as in
+    OrganismObject.fill_recognizer_rows, from the influence rows of the
+    organisms (the bounds of the placements with a gap outside the band).
+
+    If the IDs of the sequences are given and the frontier cache is enabled
+    (positive size), the rows at the bottom of each recognizer (the frontier
+    of the fill) are stored in the frontier cache, keyed by the fingerprint
+    of the organism prefix up to that recognizer. Organisms that share a
+    prefix with an organism placed before (e.g. children whose first
+    recognizers were not mutated) restart the fill from the deepest cached
+    frontier. Frontiers keep the influence row and the band cutoff bound of
+    the rows above them.
+    '''
+    plan = organisms[0].placement_plan
+    n_recogs = len(plan.recog_lengths)
+    n_orgs = len(organisms)
+    n_seqs, n = seq_codes.shape
+    rows_shape = (n_orgs, n_seqs, n+1)
+
+    # First row is set to zeros
+    final_row = np.zeros(rows_shape)
+    came_diagonally = np.zeros(rows_shape, dtype=bool)
+
+    # Influence rows, best bounds of the placements that the band may have
+    # cut off or changed, and bounds of the rest of the placements of the
+    # organisms in banded mode
+    banded = np.array([any(connector.get_gap_band() is not None
+                           for connector in org.connectors)
+                       for org in organisms])
+    influence_row = np.full(rows_shape, -1 * np.inf)
+    cutoff_bound = np.full((n_orgs, n_seqs), -1 * np.inf)
+    suffix_bounds = {org_idx: organisms[org_idx].get_suffix_upper_bounds(seq_codes, seq_ids)
+                     for org_idx in np.flatnonzero(banded)}
+
+    # Recognizer after which the fill of each organism restarts (-1 to fill
+    # all the rows), with the frontiers read from the cache
+    use_frontiers = seq_ids is not None and frontier_cache.max_bytes > 0
+    if not use_frontiers:
+        start_recogs = np.full(n_orgs, -1)
+    else:
+        prefix_fingerprints = [org.get_prefix_fingerprints() for org in organisms]
+        start_recogs, frontiers = _get_cached_frontiers(prefix_fingerprints,
+                                                        seq_ids)
+
+    for recog_idx in range(n_recogs):
+        # Organisms that restart after this recognizer
+        for org_idx in np.flatnonzero(start_recogs == recog_idx):
+            (final_row[org_idx], came_diagonally[org_idx],
+             influence_row[org_idx], cutoff_bound[org_idx]) = frontiers[org_idx]
+
+        # Organisms whose rows must be filled
+        active = np.flatnonzero(start_recogs < recog_idx)
+        if len(active) == 0:
+            continue
+        active_organisms = [organisms[org_idx] for org_idx in active]
+        (final_row[active], came_diagonally[active],
+         influence_row[active]) = _fill_recognizer(
+            active_organisms, recog_idx, seq_codes, seq_ids, final_row[active],
+            came_diagonally[active], influence_row[active], banded[active])
+
+        # Cells where a placement with a gap outside the band may replace
+        # the banded move (see OrganismObject.fill_recognizer_rows)
+        last_row = plan.recog_last_rows[recog_idx]
+        if plan.is_gap_row(last_row):
+            for org_idx in active[banded[active]]:
+                connector = organisms[org_idx].connectors[plan.gap_connector_idx[last_row]]
+                zero_gap_score = connector.gap_scores(n, plan.recog_lengths)[0]
+                replaced = (np.isfinite(final_row[org_idx]) &
+                            (influence_row[org_idx] >= final_row[org_idx]))
+                cutoff_bound[org_idx] = np.maximum(cutoff_bound[org_idx], np.where(
+                    replaced,
+                    final_row[org_idx] + max(zero_gap_score, 0) +
+                    suffix_bounds[org_idx][recog_idx],
+                    -1 * np.inf).max(axis=-1))
+
+        # Store the frontiers (the final energies are stored in the energy
+        # memo, so the last one is not needed), as the final row, the cells
+        # reached diagonally (packed in bits), and the influence row (None
+        # if the banded mode is off) and band cutoff bound
+        if use_frontiers and recog_idx < n_recogs - 1:
+            for org_idx in active:
+                prefix_fingerprint = prefix_fingerprints[org_idx][recog_idx]
+                for seq_idx, seq_id in enumerate(seq_ids.tolist()):
+                    frontier_cache.put(
+                        (prefix_fingerprint, seq_id),
+                        (final_row[org_idx, seq_idx],
+                         np.packbits(came_diagonally[org_idx, seq_idx]),
+                         influence_row[org_idx, seq_idx] if banded[org_idx] else None,
+                         float(cutoff_bound[org_idx, seq_idx])))
+
+    # The band may have cut off the optimum where a placement that it cut
+    # off or changed could score as much as the energy
+    energies = final_row.max(axis=-1)
+    cutoff_bound = np.maximum(cutoff_bound, influence_row.max(axis=-1))
+    band_cutoffs = banded[:, None] & np.isfinite(cutoff_bound) & (cutoff_bound >= np.array([
+        org.apply_energy_threshold(energies[org_idx])
+        for org_idx, org in enumerate(organisms)]).reshape(n_orgs, n_seqs))
+    return energies, band_cutoffs
+
+
+def _get_cached_frontiers(prefix_fingerprints, seq_ids):
+    '''
+    Returns, for each organism, the deepest recognizer whose frontier (the
+    rows after its gap moves) is in the frontier cache for all the
+    sequences (-1 if none), and a dictionary with the frontier rows found
+    (final row, cells reached diagonally, influence row and band cutoff
+    bound) for each organism.
+    '''
+    start_recogs = np.full(len(prefix_fingerprints), -1)
+    frontiers = {}
+    seq_ids = seq_ids.tolist()
+    for org_idx, fingerprints in enumerate(prefix_fingerprints):
+        # The frontier of the last recognizer is never stored
+        for recog_idx in range(len(fingerprints) - 2, -1, -1):
+            cached = []
+            for seq_id in seq_ids:
+                frontier = frontier_cache.get((fingerprints[recog_idx], seq_id))
+                if frontier is None:
+                    break
+                cached.append(frontier)
+            if len(cached) == len(seq_ids):
+                final_rows, packed, influence_rows, cutoff_bounds = zip(*cached)
+                final_rows = np.stack(final_rows)
+                came_diagonally = np.unpackbits(
+                    np.stack(packed), axis=-1,
+                    count=final_rows.shape[-1]).astype(bool)
+                if influence_rows[0] is None:
+                    influence_rows = np.full(final_rows.shape, -1 * np.inf)
+                else:
+                    influence_rows = np.stack(influence_rows)
+                start_recogs[org_idx] = recog_idx
+                frontiers[org_idx] = (final_rows, came_diagonally,
+                                      influence_rows, np.array(cutoff_bounds))
+                break
+    return start_recogs, frontiers
+
+
+def _fill_recognizer(organisms, recog_idx, seq_codes, seq_ids, final_row,
+                     came_diagonally, influence_row, banded):
+    '''
+    Fills the rows of the given recognizer for all the organisms, from the
+    rows after the previous recognizer (final_row, came_diagonally and the
+    influence row of the organisms in banded mode, flagged by banded).
+    Returns the last row of the recognizer after the gap moves, the cells
+    that were reached with a diagonal move, and the influence row (see
+    OrganismObject.get_influence_row).
+    '''
+    plan = organisms[0].placement_plan
+    length = plan.recog_lengths[recog_idx]
+    first_row = plan.recog_first_rows[recog_idx]
+    last_row = plan.recog_last_rows[recog_idx]
+    n = seq_codes.shape[1]
+
+    # Scan the PSSMs across the sequences, and place them after the
+    # previous row
+    diag_row = np.full(final_row.shape, -1 * np.inf)
+    influence_diag = np.full(final_row.shape, -1 * np.inf)
+    first_window, last_window = plan.get_feasible_columns(first_row - 1, n)
+    n_windows = min(last_window, n - length) - first_window + 1
+    if n_windows > 0:
+        zero_gap_terms = _get_zero_gap_terms(organisms, first_row,
+                                             came_diagonally)
+        windows = slice(first_window, first_window + n_windows)
+        if seq_ids is None:
+            # PSSM scores of the organisms, as an (organisms x rows x 4)
+            # array
+            pssm_scores = np.stack([org.placement_plan.pssm_scores
+                                    for org in organisms])
+            org_idx = np.arange(len(organisms))[:, None, None]
+            window_scores = None
+            for c in range(length):
+                start = first_window + c
+                column_scores = pssm_scores[
+                    org_idx, first_row + c, seq_codes[None, :, start:start + n_windows]]
+                if window_scores is None:
+                    window_scores = column_scores
+                else:
+                    window_scores = window_scores + column_scores
+        else:
+            window_scores = np.stack([
+                get_window_scores(
+                    org.placement_plan.pssm_scores[first_row:last_row + 1],
+                    org.placement_plan.recog_fingerprints[recog_idx],
+                    seq_codes, seq_ids)[:, windows]
+                for org in organisms])
+        diag_row[..., first_window+length:first_window+length+n_windows] = (
+            final_row[..., windows] + (zero_gap_terms[..., windows] + window_scores))
+        if banded.any():
+            zero_gap_scores = np.maximum(_get_zero_gap_scores(organisms, first_row, n), 0)
+            influence_diag[banded, :, first_window+length:first_window+length+n_windows] = (
+                influence_row[banded][..., windows] +
+                (zero_gap_scores[banded, None, None] + window_scores[banded]))
+
+    # Gap moves
+    row, came_diagonally = _apply_gap_moves(organisms, last_row, diag_row)
+    return row, came_diagonally, _get_influence_rows(
+        organisms, last_row, diag_row, influence_diag, banded)
+
+
+def _get_zero_gap_terms(organisms, first_row, came_diagonally):
+    '''
+    Returns the 0-bp gap scores to be added to the cells of the first row of
+    a PSSM (see OrganismObject.get_zero_gap_terms), for all the organisms.
+    '''
+    n = came_diagonally.shape[-1] - 1
+    if not came_diagonally.any():
+        return np.zeros(came_diagonally.shape)
+    zero_gap_scores = _get_zero_gap_scores(organisms, first_row, n)
+    return np.where(came_diagonally, zero_gap_scores[:, None, None], 0.0)
+
+
+def _get_zero_gap_scores(organisms, first_row, n):
+    '''
+    Returns the 0-bp gap score of the connector before the PSSM that starts
+    on the given row, for each organism (see
+    OrganismObject.get_zero_gap_score).
+    '''
+    plan = organisms[0].placement_plan
+    connector_idx = plan.zero_gap_connector_idx[first_row]
+    if connector_idx < 0:
+        return np.zeros(len(organisms))
+    return np.array(
+        [org.connectors[connector_idx].gap_scores(n, plan.recog_lengths)[0]
+         for org in organisms])
+
+
+def _apply_gap_moves(organisms, row_idx, diag_row):
+    '''
+    Applies the gap moves on the given row for all the organisms (see
+    OrganismObject.apply_gap_moves). Returns the row after the gap moves and
+    the cells that were reached with a diagonal move.
+    '''
+    plan = organisms[0].placement_plan
+    n_orgs, n_seqs, n = diag_row.shape[0], diag_row.shape[1], diag_row.shape[2] - 1
+    came_diagonally = np.ones(diag_row.shape, dtype=bool)
+    came_diagonally[..., 0] = False
+    if not plan.is_gap_row(row_idx):
+        return diag_row, came_diagonally
+
+    first_col, last_col = plan.get_feasible_columns(row_idx, n)
+    if last_col < first_col:
+        return diag_row, came_diagonally
+    width = last_col - first_col + 1
+
+    # Gap scores of each organism, and the band of its connector (the range
+    # of gap sizes evaluated, None if the banded mode is off)
+    gap_scores_by_size = np.empty((n_orgs, width))
+    bands = []
+    for idx, org in enumerate(organisms):
+        connector = org.connectors[plan.gap_connector_idx[row_idx]]
+        gap_scores = np.full(n+1, -1 * np.inf)
+        gap_scores[1:n] = connector.gap_scores(n, plan.recog_lengths)[1:n]
+        gap_scores_by_size[idx] = gap_scores[:width]
+        bands.append(connector.get_gap_band())
+
+    # Best gaps on the feasible columns, one line per organism and sequence.
+    # Organisms are grouped by band, so that only the gap sizes within the
+    # band are evaluated.
+    feasible = slice(first_col, last_col + 1)
+    best_gap_scores = np.full(diag_row.shape, -1 * np.inf)
+    band_groups = {}
+    for idx, band in enumerate(bands):
+        band_groups.setdefault((1, n) if band is None else band, []).append(idx)
+    for (min_size, max_size), group in band_groups.items():
+        group = np.array(group)
+        best_gap_scores[group, :, feasible] = gap_transition(
+            diag_row[group][..., feasible].reshape(len(group) * n_seqs, width),
+            np.repeat(gap_scores_by_size[group], n_seqs, axis=0),
+            min_size, max_size)[0].reshape(len(group), n_seqs, width)
+
+    # Gaps replace diagonal moves when they are at least as good
+    gap_won = best_gap_scores >= diag_row
+    gap_won[..., 0] = False
+    row = diag_row.copy()
+    row[gap_won] = best_gap_scores[gap_won]
+    came_diagonally[gap_won] = False
+    return row, came_diagonally
+
+
+def _get_influence_rows(organisms, row_idx, diag_row, influence_diag, banded):
+    '''
+    Returns the influence rows of the given row for the organisms in banded
+    mode (see OrganismObject.get_influence_row), -inf for the others.
+    '''
+    plan = organisms[0].placement_plan
+    if not plan.is_gap_row(row_idx):
+        return influence_diag
+
+    n = diag_row.shape[-1] - 1
+    influence_row = np.full(diag_row.shape, -1 * np.inf)
+    first_col, last_col = plan.get_feasible_columns(row_idx, n)
+    if last_col < first_col:
+        return influence_row
+    feasible = slice(first_col, last_col + 1)
+    for idx in np.flatnonzero(banded):
+        connector = organisms[idx].connectors[plan.gap_connector_idx[row_idx]]
+        band = connector.get_gap_band()
+        min_size, max_size = (1, n) if band is None else band
+        gap_scores = np.full(n+1, -1 * np.inf)
+        gap_scores[1:n] = connector.gap_scores(n, plan.recog_lengths)[1:n]
+        influence_row[idx, :, feasible] = get_out_of_band_bounds(
+            diag_row[idx, :, feasible], influence_diag[idx, :, feasible],
+            gap_scores[:last_col - first_col + 1], min_size, max_size)
+    return influence_row
@@ -14,6 +14,7 @@
 import random
 import numpy as np
 import decimal as dec
+from .sequence_dataset_object import BASES
 
 
 class PssmObject():
@@ -37,6 +38,7 @@ class PssmObject():
         self.length = len(pwm)  # length of the numpy array
         self.pwm = pwm  # numpy array of dictionaries
         self.pssm = None #scoring matrix
+        self.pssm_scores = None #scoring matrix as a Lx4 array (a, c, g, t)
         
         # assign PSSM-specific configuration elements
         self.mutate_probability_random_col = config[
@@ -81,11 +83,15 @@ class PssmObject():
         self.length = len(self.pwm)
 
 
-    def mutate(self, org_factory) -> None:
+    def mutate(self, org_factory) -> tuple:
         """Mutation operators associated to the PSSM recognizer
 
         Args:
             org_factory (OrganismFactory): Creates objects
+
+        Returns:
+            Whether any mutation operator was applied, and the
+            pssm-displacement code (None if the PSSM boundaries didn't move)
         """
         
         # Code to keep track if mutations that shift the boundaries of the
@@ -93,7 +99,11 @@ class PssmObject():
         # decrease pwm).
         pssm_displacement_code = [0, 0]
         
+        # Whether any mutation operator was applied
+        changed = False
+        
         if random.random() < self.mutate_probability_random_col:
+            changed = True
 
             # Randomize PSSM column 
             # [substitutes column with a randomized column]
@@ -106,6 +116,7 @@ class PssmObject():
         if random.random() < self.mutate_probability_mutate_col:
             '''Mutate a column of the PSSM. The mutation involves transferring
             some of the weight from a "donor" base to an "acceptor" base'''
+            changed = True
             # Chose a random column of that PSSM
             idx_of_random_col = random.randint(0, self.length - 1)
             
@@ -146,6 +157,7 @@ class PssmObject():
             self.pwm[idx_of_random_col][acceptor_base] = acceptor_new_prob
 
         if random.random() < self.mutate_probability_flip_cols:
+            changed = True
             # Swaps two PSSM columns
             # col1 --> col2, col2 --> col1
             col1, col2 = random.sample(range(self.length), 2)
@@ -155,6 +167,7 @@ class PssmObject():
             self.pwm[col2] = tmp_col
 
         if random.random() < self.mutate_probability_flip_rows:
+            changed = True
             # Swaps two PSSM rows
             
             # Pick rows (A, C, T or G) to be swapped
@@ -169,6 +182,7 @@ class PssmObject():
                 self.pwm[i][base2] = tmp_base
 
         if random.random() < self.mutate_probability_shift_left:
+            changed = True
             # Shift PSSM from right to left, rolling over
             self.pwm = np.roll(self.pwm, 1)
             
@@ -178,6 +192,7 @@ class PssmObject():
             pssm_displacement_code[1] -= 1
 
         if random.random() < self.mutate_probability_shift_right:
+            changed = True
             # Shift PSSM from left to right, rolling over
             self.pwm = np.roll(self.pwm, -1)
             
@@ -189,6 +204,7 @@ class PssmObject():
         if random.random() < self.mutate_probability_increase_pwm:
             # Increase length of PWM
             if self.length < self.max_columns: # do only if allowed
+                changed = True
 
                 #generate a new column
                 new_col = org_factory.get_pwm_column()
@@ -216,6 +232,7 @@ class PssmObject():
         if random.random() < self.mutate_probability_decrease_pwm:
             # Decrease length of PWM
             if self.length > self.min_columns:
+                changed = True
                 
                 # Remove a column from one side (chose randomly left or right)
                 if random.random() < 0.5:
@@ -238,12 +255,14 @@ class PssmObject():
         # recompute PSSM
         # mutation operators affect the PWM (frequency matrix)
         # so the PSSM is re-computed after mutations take place
-        self.recalculate_pssm()
+        if changed:
+            self.recalculate_pssm()
         
         # If the PSSM boundaries have changed, report the pssm-displacement
         # code, so that connectors can eventually be adjusted if necessary
         if pssm_displacement_code != [0, 0]:
-            return pssm_displacement_code
+            return changed, pssm_displacement_code
+        return changed, None
 
     # Calculate self.pssm based on self.pwm
     def recalculate_pssm(self) -> None:
@@ -279,6 +298,10 @@ class PssmObject():
             )
         # Assign re-computed PSSM
         self.pssm = np.array(tmp_pssm)
+        # Same scores as a Lx4 array, indexed by encoded base (a, c, g, t)
+        self.pssm_scores = np.array(
+            [[column[base] for base in BASES] for column in tmp_pssm]
+        ).reshape(-1, len(BASES))
 
 
     def get_score(self, s_dna: str) -> float:
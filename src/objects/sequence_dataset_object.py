@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Sequence dataset object
+It stores a set of DNA sequences, encoded once (at load time) as arrays of
+base indexes, so that placements can index PSSM scores directly.
+"""
+
+from collections.abc import Sequence
+import numpy as np
+
+
+# Order of the bases in the encoded DNA sequences (a=0, c=1, g=2, t=3)
+BASES = ["a", "c", "g", "t"]
+
+# Lookup table from ASCII codes to base indexes (-1 for invalid characters)
+_BASE_INDEX_TABLE = np.full(256, -1, dtype=np.int8)
+for _idx, _base in enumerate(BASES):
+    _BASE_INDEX_TABLE[ord(_base)] = _idx
+    _BASE_INDEX_TABLE[ord(_base.upper())] = _idx
+
+# Lookup table from base indexes to ASCII codes
+_BASE_ASCII_TABLE = np.array([ord(base) for base in BASES], dtype=np.uint8)
+
+
+def encode_dna_sequence(dna_sequence: str) -> np.ndarray:
+    ''' Returns the DNA sequence as an array of base indexes (a=0, c=1, g=2,
+    t=3). '''
+    ascii_codes = np.frombuffer(dna_sequence.encode("ascii"), dtype=np.uint8)
+    seq_codes = _BASE_INDEX_TABLE[ascii_codes]
+    if (seq_codes < 0).any():
+        raise ValueError("DNA sequence contains characters other than a, c, g, t.")
+    return seq_codes.astype(np.uint8)
+
+
+def decode_dna_sequence(seq_codes: np.ndarray) -> str:
+    ''' Returns the (lowercase) DNA string of an encoded sequence. '''
+    return _BASE_ASCII_TABLE[seq_codes].tobytes().decode("ascii")
+
+
+def as_encoded_sequence(dna_sequence) -> np.ndarray:
+    ''' Returns the given DNA sequence as an array of base indexes. Encoded
+    sequences (e.g. the elements of a SequenceDataset) are returned as they
+    are, while strings are encoded. '''
+    if isinstance(dna_sequence, str):
+        return encode_dna_sequence(dna_sequence)
+    return np.asarray(dna_sequence, dtype=np.uint8)
+
+
+class SequenceDataset(Sequence):
+    """
+    Sequence dataset object
+
+    All the sequences are stored back to back in a single contiguous uint8
+    array of base indexes. The sequence with index k spans
+    seq_codes[offsets[k]:offsets[k+1]], and has a stable identifier ids[k]
+    that doesn't change when the dataset is shuffled or sliced.
+
+    Indexing the dataset with an integer returns the encoded sequence (a
+    read-only view on the contiguous array). Indexing it with a slice returns
+    a new dataset with the selected sequences.
+    """
+
+    def __init__(self, seq_codes, offsets, ids):
+        """
+        SequenceDataset object constructor.
+
+        Args:
+            seq_codes: contiguous uint8 array with all the encoded sequences
+            offsets: array of N+1 positions where each sequence starts (the
+                     last element is the total length)
+            ids: array of N stable sequence identifiers
+        """
+        self.seq_codes = np.ascontiguousarray(seq_codes, dtype=np.uint8)
+        self.seq_codes.flags.writeable = False
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets)
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    @classmethod
+    def from_strings(cls, sequences: list, first_id: int = 0):
+        """
+        Encodes a list of DNA strings into a new dataset. Sequence IDs are
+        assigned consecutively, starting from first_id, in the order of the
+        list.
+        """
+        encoded = [encode_dna_sequence(seq) for seq in sequences]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(seq) for seq in encoded])
+        if len(encoded) > 0:
+            seq_codes = np.concatenate(encoded)
+        else:
+            seq_codes = np.zeros(0, dtype=np.uint8)
+        ids = np.arange(first_id, first_id + len(encoded))
+        return cls(seq_codes, offsets, ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.subset(range(len(self))[idx])
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("SequenceDataset index out of range")
+        return self.seq_codes[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.seq_codes[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def subset(self, indexes):
+        '''
+        Returns a new dataset made of the sequences at the given indexes (in
+        the given order). Sequence IDs are preserved.
+        '''
+        indexes = np.asarray(indexes, dtype=np.int64)
+        lengths = self.lengths[indexes]
+        offsets = np.zeros(len(indexes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        if len(indexes) > 0:
+            seq_codes = np.concatenate(
+                [self.seq_codes[self.offsets[i]:self.offsets[i + 1]] for i in indexes])
+        else:
+            seq_codes = np.zeros(0, dtype=np.uint8)
+        return SequenceDataset(seq_codes, offsets, self.ids[indexes])
+
+    def sorted_by_id(self):
+        '''
+        Returns the dataset with the sequences sorted by ID, i.e. in the order
+        in which they were loaded, regardless of any shuffling.
+        '''
+        return self.subset(np.argsort(self.ids, kind="stable"))
+
+    def get_sequence_string(self, idx: int) -> str:
+        ''' Returns the sequence at the given index as a DNA string. '''
+        return decode_dna_sequence(self[idx])
+
+    def get_id(self, idx: int) -> int:
+        ''' Returns the ID of the sequence at the given index. '''
+        return int(self.ids[idx])
@@ -16,7 +16,14 @@ import os
 # import io
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.stats import t as t_distribution
 from objects.organism_factory import OrganismFactory
+from objects.sequence_dataset_object import SequenceDataset
+from objects.population_placement import get_group_energies
+from objects.energy_memo import energy_memo
+from objects.placement_cache import scan_cache, frontier_cache
+from objects.fitness_functions import (get_fitness_function,
+                                       get_welchs_standard_errors)
 from Bio import SeqIO
 
 """
@@ -37,6 +44,18 @@ MIN_ITERATIONS = 0
 MIN_FITNESS = 0
 RECOMBINATION_PROBABILITY = 0.0
 THRESHOLD = 0.0
+EARLY_ABANDON_SEQUENCES = None
+RACING_CONFIDENCE = None
+RACING_SEQUENCES = 0
+SAMPLE_SIZE_SCHEDULE = None
+INITIAL_SEQUENCES_TO_FIT = 0
+SAMPLE_SIZE_GROWTH_FACTOR = 2
+SAMPLE_SIZE_VARIANCE_THRESHOLD = 0.0
+
+# Margin by which the optimistic fitness of a child must be below the
+# fitness of its parent for the child to be abandoned (covers rounding
+# errors in the fitness computations)
+EARLY_ABANDON_MARGIN = 1e-8
 
 JSON_CONFIG_FILENAME = "config.json"
 """
@@ -59,6 +78,11 @@ mean_nodes: float = 0
 # used to calculate organism complexity
 mean_fitness: float = 0
 
+# Number of sequences of each set currently used to compute fitness (they
+# grow up to MAX_SEQUENCES_TO_FIT_POS/NEG if SAMPLE_SIZE_SCHEDULE is set)
+sequences_to_fit_pos: int = 0
+sequences_to_fit_neg: int = 0
+
 # Initialize datasets
 positive_dataset: list = []
 negative_dataset: list = []
@@ -78,7 +102,9 @@ def main():
     # XXX
     if NEGATIVE_FILENAME is not None:
         # Read negative set from specified file
-        negative_dataset = read_fasta_file(DATASET_BASE_PATH_DIR + NEGATIVE_FILENAME)
+        # (sequence IDs continue after the ones of the positive set)
+        negative_dataset = read_fasta_file(DATASET_BASE_PATH_DIR + NEGATIVE_FILENAME,
+                                           first_id=len(positive_dataset))
     else:
         # If no file was specified for negative set, it's generated from positive set
         if i_am_main_process():
@@ -159,6 +185,8 @@ def main():
     iterations = 0
     max_score = float("-inf")
     last_max_score = 0.0
+    # Fitness of the organisms of the population in the iteration
+    a_fitness = []
     # Organism with highest fitness in the simulation
     best_organism = (
         None,  # the organism object
@@ -198,6 +226,10 @@ def main():
             # my_ids = [org._id for org in organism_population]
             # print("From process " + str(rank) + ": loc pop is " + str(my_ids))
         
+        # Grow the samples used to compute fitness (if required)
+        samples_grown = (SAMPLE_SIZE_SCHEDULE is not None and iterations > 0 and
+                         update_sample_size(max_score, last_max_score, a_fitness))
+        
         # XXX
         # Shuffle datasets (if required)
         if RANDOM_SHUFFLE_SAMPLING_POS:
@@ -205,6 +237,19 @@ def main():
         if RANDOM_SHUFFLE_SAMPLING_NEG:
             negative_dataset = shuffle_dataset(negative_dataset)
         
+        # Fitness values computed on the smaller samples are not comparable
+        # with the new ones, so the best organism is scored again on the
+        # grown samples (its energies on the smaller ones come from the
+        # energy memo)
+        if samples_grown and best_organism[0] is not None:
+            best_organism = (
+                best_organism[0],
+                evaluate_population([best_organism[0]],
+                                    positive_dataset[:sequences_to_fit_pos],
+                                    negative_dataset[:sequences_to_fit_neg])[0],
+                best_organism[2]
+            )
+        
         # Reset max_score
         last_max_score = max_score
         max_score = float("-inf")
@@ -213,8 +258,18 @@ def main():
         
         a_fitness = []
         a_nodes = []
+        a_sequences = []
+        a_band_cutoffs = []
+        
+        # Deterministic crowding, in three phases: reproduction of all the
+        # pairs, evaluation of all the competing organisms at once, and
+        # competitions (in the same order as pair-by-pair processing, so
+        # that random calls and selection results are unchanged)
+        
+        # Reproduction
+        # List of (population index, parent, child) competitions
+        competitions = []
         
-        # Deterministic crowding
         # Iterate over pairs of organisms
         for i in range(0, len(organism_population) - 1, 2):
             org1 = organism_population[i]
@@ -234,7 +289,9 @@ def main():
                 # Non-recomination case; the children get mutated
                 child1, child2 = organism_factory.clone_parents(org1, org2)
                 # Mutate the children: the children in this non-recombination
-                # case are just a mutated versions of the parents
+                # case are just a mutated versions of the parents. Children
+                # left unchanged by mutate keep the genome fingerprint of
+                # their parent, so their energies come from the energy memo
                 child1.mutate(organism_factory)
                 child2.mutate(organism_factory)
             
@@ -285,191 +342,87 @@ def main():
                 else:
                     pair_children.append( (org2, copy.deepcopy(org2)) )
             
-            # Make the two organisms in each pair compete
-            # j index is used to re insert winning organism into the population
+            # Each parent will compete with the child it is paired with.
+            # The winner of the competition will replace element i+j in
+            # organism_population (j is 0 for organism i, 1 for i+1)
             for j in range(len(pair_children)):
-                '''
-                when j is 0 we are dealing with organism i
-                when j is 1 we are dealing with organism i+1
-                
-                Therefore, the winner of the competition will replace element
-                i+j in  organism_population
-                '''
+                competitions.append((i + j, pair_children[j][0], pair_children[j][1]))
+            
+            # END FOR i
+        
+        # Evaluation
+        # Score all the organisms in the competitions (parent and child of
+        # each competition, in order) with population-level calls
+        positive_sample = positive_dataset[:sequences_to_fit_pos]
+        negative_sample = negative_dataset[:sequences_to_fit_neg]
+        fitness_values, a_sequences = evaluate_competitions(
+            competitions, positive_sample, negative_sample)
+        
+        # Competition
+        for k, (pop_idx, first_organism, second_organism) in enumerate(competitions):
+            # first_organism is the parent and second_organism the child
+            fitness1 = fitness_values[2 * k]
+            fitness2 = fitness_values[2 * k + 1]
+            
+            if fitness1 > fitness2:  # The first organism wins (the parent wins)
+                # Set it back to the population and save fitness
+                # for next iteration
+                organism_population[pop_idx] = first_organism
+                a_fitness.append(fitness1)
+                # If the parent wins, mean_nodes don't change
+                a_nodes.append(first_organism.count_nodes())
+
+                # Check if its the max score in that iteration
+                if fitness1 > max_score:
+                    max_score = fitness1
+                    max_organism = (
+                        first_organism,
+                        fitness1,
+                        first_organism.count_nodes()
+                    )
 
-                first_organism = pair_children[j][0]  # Parent Organism
-                second_organism = pair_children[j][1]  # Child Organism
-                
-                # Boltzmannian fitness
-                if FITNESS_FUNCTION == "boltzmannian":
-                    performance1 = first_organism.get_boltz_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS],
-                                                                    negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG],
-                                                                    GENOME_LENGTH)
-                    fitness1 = performance1["score"]
-                    
-                    performance2 = second_organism.get_boltz_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS],
-                                                                     negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG],
-                                                                     GENOME_LENGTH)
-                    fitness2 = performance2["score"]
-                    
-                    fitness1 = round(fitness1, 8)
-                    fitness2 = round(fitness2, 8)
-                
-                # Kolmogorov fitness
-                # Computes Kolmogorov-Smirnov test on positive/negative set scores
-                elif FITNESS_FUNCTION == "kolmogorov":
-                    performance1 = first_organism.get_kolmogorov_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS],
-                                                                    negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])
-                    fitness1 = performance1["score"]
-                    
-                    performance2 = second_organism.get_kolmogorov_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS],
-                                                                    negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])
-
-                    fitness2 = performance2["score"]
-                    
-                    fitness1 = round(fitness1, 8)
-                    fitness2 = round(fitness2, 8)
-
-                # Discriminative fitness
-                elif FITNESS_FUNCTION == "discriminative":
-                    positive_performance1 = first_organism.get_additive_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS])
-                    negative_performance1 = first_organism.get_additive_fitness(negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])
-                    p_1 = positive_performance1["score"]
-                    n_1 = negative_performance1["score"]
-                    fitness1 =  p_1 - n_1
-                    
-                    positive_performance2 = second_organism.get_additive_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS])
-                    negative_performance2 = second_organism.get_additive_fitness(negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])
-                    p_2 = positive_performance2["score"]
-                    n_2 = negative_performance2["score"]
-                    fitness2 =  p_2 - n_2
-                
-                elif FITNESS_FUNCTION == "welchs":
-                    # First organism
-                    positive_performance1 = first_organism.get_additive_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS])
-                    negative_performance1 = first_organism.get_additive_fitness(negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])
-                    p_1 = positive_performance1["score"]
-                    n_1 = negative_performance1["score"]
-                    
-                    # Standard deviations
-                    sigma_p_1 = positive_performance1["stdev"]
-                    sigma_n_1 = negative_performance1["stdev"]
-                    
-                    # Lower bound to sigma
-                    # (Being more consistent than that on the sets will not help
-                    # your fitness)
-                    if sigma_p_1 < 1:
-                        sigma_p_1 = 1
-                    if sigma_n_1 < 1:
-                        sigma_n_1 = 1
-                    
-                    # Standard errors
-                    sterr_p_1 = sigma_p_1 / MAX_SEQUENCES_TO_FIT_POS**(1/2)
-                    sterr_n_1 = sigma_n_1 / MAX_SEQUENCES_TO_FIT_NEG**(1/2)
-                    
-                    # Welch's t score
-                    fitness1 =  (p_1 - n_1) / (sterr_p_1**2 + sterr_n_1**2)**(1/2)
-                    
-                    # Second organism
-                    positive_performance2 = second_organism.get_additive_fitness(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS])
-                    negative_performance2 = second_organism.get_additive_fitness(negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])
-                    p_2 = positive_performance2["score"]
-                    n_2 = negative_performance2["score"]
-                    
-                    # Standard deviations
-                    sigma_p_2 = positive_performance2["stdev"]
-                    sigma_n_2 = negative_performance2["stdev"]
-                    
-                    # Lower bound to sigma
-                    # (Being more consistent than that on the sets will not help
-                    # your fitness)
-                    if sigma_p_2 < 1:
-                        sigma_p_2 = 1
-                    if sigma_n_2 < 1:
-                        sigma_n_2 = 1
-                    
-                    # Standard errors
-                    sterr_p_2 = sigma_p_2 / MAX_SEQUENCES_TO_FIT_POS**(1/2)
-                    sterr_n_2 = sigma_n_2 / MAX_SEQUENCES_TO_FIT_NEG**(1/2)
-                    
-                    # Welch's t score
-                    fitness2 =  (p_2 - n_2) / (sterr_p_2**2 + sterr_n_2**2)**(1/2)
-                                    
-                else:
-                    raise Exception("Not a valid fitness function name, "
-                                    + "check the configuration file.")
-                
-                if MAX_NODES != None:  # Upper_bound to complexity
-                    
-                    if first_organism.count_nodes() > MAX_NODES:
-                        fitness1 = -1000 * int(first_organism.count_nodes())
-                    
-                    if second_organism.count_nodes() > MAX_NODES:
-                        fitness2 = -1000 * int(second_organism.count_nodes())
-
-                if MIN_NODES != None:  # Lower_bound to complexity
-                    
-                    if first_organism.count_nodes() < MIN_NODES:
-                        fitness1 = -1000 * int(first_organism.count_nodes())
-                    
-                    if second_organism.count_nodes() < MIN_NODES:
-                        fitness2 = -1000 * int(second_organism.count_nodes())
-                
-                
-                # Competition
-                if fitness1 > fitness2:  # The first organism wins (the parent wins)
-                    # Set it back to the population and save fitness
-                    # for next iteration
-                    organism_population[i + j] = first_organism
-                    a_fitness.append(fitness1)
-                    # If the parent wins, mean_nodes don't change
-                    a_nodes.append(first_organism.count_nodes())
-
-                    # Check if its the max score in that iteration
-                    if fitness1 > max_score:
-                        max_score = fitness1
-                        max_organism = (
-                            first_organism,
-                            fitness1,
-                            first_organism.count_nodes()
-                        )
-
-                    # Check if its the max score so far and if it is set it as
-                    # best organism
-                    if max_organism[1] > best_organism[1]:
-                        # ID, EF, Nodes, Penalty applied
-                        best_organism = max_organism
-                        changed_best_score = True
-
-                else:  # The second organism wins (the child wins)
-                    # Set it back to the population and save fitness for next
-                    # iteration
-                    organism_population[i + j] = second_organism
-                    a_fitness.append(fitness2)
-                    # If the child wins, update mean_nodes
-                    # mean_nodes = ((meanNodes * POPULATION_LENGTH) +
-                    # second_organism.count_nodes() -
-                    # first_organism.count_nodes()) / POPULATION_LENGTH
-                    a_nodes.append(second_organism.count_nodes())
-
-                    # Check if its the max score in that iteration
-                    if fitness2 > max_score:
-                        max_score = fitness2
-                        max_organism = (
-                            second_organism,
-                            fitness2,
-                            second_organism.count_nodes()
-                        )
-
-                    # Check if its the max score so far and if it is set it as
-                    # best organism
-                    if fitness2 > best_organism[1]:
-                        # ID, EF, Nodes, Penalty applied
-                        best_organism = max_organism
-                        changed_best_score = True
-
-                # END FOR j
+                # Check if its the max score so far and if it is set it as
+                # best organism
+                if max_organism[1] > best_organism[1]:
+                    # ID, EF, Nodes, Penalty applied
+                    best_organism = max_organism
+                    changed_best_score = True
+
+            else:  # The second organism wins (the child wins)
+                # Set it back to the population and save fitness for next
+                # iteration
+                organism_population[pop_idx] = second_organism
+                a_fitness.append(fitness2)
+                # If the child wins, update mean_nodes
+                # mean_nodes = ((meanNodes * POPULATION_LENGTH) +
+                # second_organism.count_nodes() -
+                # first_organism.count_nodes()) / POPULATION_LENGTH
+                a_nodes.append(second_organism.count_nodes())
+
+                # Check if its the max score in that iteration
+                if fitness2 > max_score:
+                    max_score = fitness2
+                    max_organism = (
+                        second_organism,
+                        fitness2,
+                        second_organism.count_nodes()
+                    )
 
-            # END FOR i
+                # Check if its the max score so far and if it is set it as
+                # best organism
+                if fitness2 > best_organism[1]:
+                    # ID, EF, Nodes, Penalty applied
+                    best_organism = max_organism
+                    changed_best_score = True
+
+            # END FOR k
+        
+        # Energies of the population on the samples that may be approximate
+        # (the band of the banded placement mode may have cut off the optimum)
+        for organism in organism_population:
+            a_band_cutoffs.append(
+                int(organism.get_cached_band_cutoffs(positive_sample.ids).sum() +
+                    organism.get_cached_band_cutoffs(negative_sample.ids).sum()))
         
         if RUN_MODE == 'parallel':  # XXX
             # GATHER AND FLATTEN THE POPULATION
@@ -487,6 +440,10 @@ def main():
             a_fitness = flatten_population(a_fitness)
             a_nodes   = comm.gather(a_nodes,   root=0)
             a_nodes   = flatten_population(a_nodes)
+            a_sequences = comm.gather(a_sequences, root=0)
+            a_sequences = flatten_population(a_sequences)
+            a_band_cutoffs = comm.gather(a_band_cutoffs, root=0)
+            a_band_cutoffs = flatten_population(a_band_cutoffs)
         
         if i_am_main_process():
             # Mean fitness in the population
@@ -506,6 +463,7 @@ def main():
             print_ln(
                 (
                     "Iter: {} AF:{:.2f} SDF:{:.2f} GF:{:.2f} AN:{:.2f}"
+                    + " SS: {}/{} MS: {:.1f} BC: {}"
                     + " - MO: {} MF: {:.2f} MN: {}"
                     + " -  BO: {} BF: {:.2f} BN: {} Time: {}"
                 ).format(
@@ -514,6 +472,11 @@ def main():
                     standard_dev_fitness,  # "SDF"
                     gini_fitness,  # "GF"
                     mean_nodes,  # "AN"
+                    len(positive_sample) + len(negative_sample),  # "SS" (sample size)
+                    (len(positive_dataset[:MAX_SEQUENCES_TO_FIT_POS]) +
+                     len(negative_dataset[:MAX_SEQUENCES_TO_FIT_NEG])),
+                    np.mean(a_sequences),  # "MS" (mean sequences used per competition)
+                    sum(a_band_cutoffs),  # "BC"
                     max_organism[0]._id,  # "MO"
                     max_organism[1],  # "MF" (fitness)
                     max_organism[2],  # "MN" (nodes)
@@ -525,6 +488,17 @@ def main():
                 RESULT_BASE_PATH_DIR + OUTPUT_FILENAME,
             )
             
+            # Log the number of sequences used by each competition
+            if RACING_CONFIDENCE is not None:
+                print_ln(
+                    "Iter: {} MS: {:.2f} Sequences: {}".format(
+                        iterations,  # "Iter"
+                        np.mean(a_sequences),  # "MS" (mean sequences)
+                        " ".join(str(n) for n in a_sequences)
+                    ),
+                    RESULT_BASE_PATH_DIR + "racing.txt",
+                )
+            
             # Print against a random positive sequence
             pos_seq_index = random.randint(0, len(positive_dataset)-1)
             placement = max_organism[0].get_placement(positive_dataset[pos_seq_index], traceback=True)
@@ -536,8 +510,8 @@ def main():
                 # If the dataset is shuffled, prepare a sorted version for the
                 # 'export' functions, so that regardless of the current status of
                 # the dataset, the sequences exported are always the same and
-                # always appear in the same order.
-                pos_set_for_export = sorted(positive_dataset)
+                # always appear in the same order (the order of the FASTA file).
+                pos_set_for_export = positive_dataset.sorted_by_id()
             else:
                 pos_set_for_export = positive_dataset
             
@@ -576,9 +550,9 @@ def main():
         # END WHILE
 
 
-def shuffle_dataset(dataset: list) -> list:
+def shuffle_dataset(dataset: SequenceDataset) -> SequenceDataset:
     '''
-    Returns the dataset (list of DNA sequences) in random order. Instead of
+    Returns the dataset (SequenceDataset) in random order. Instead of
     directly shuffling the list, the indexes are shuffled. This is done to
     minimize the amount of MPI communication when the program is run in
     parallel mode. Indeed, we want all the processes to compute fitness on the
@@ -593,7 +567,409 @@ def shuffle_dataset(dataset: list) -> list:
         # In parallel runs, the order is the one generated by process 0
         indexes = comm.bcast(indexes, root=0)
     # Sort dataset according to indexes
-    return [dataset[i] for i in indexes]
+    return dataset.subset(indexes)
+
+
+def get_population_energies(organisms: list, dataset: SequenceDataset) -> np.ndarray:
+    '''
+    Returns the energies of all the organisms on all the sequences of the
+    dataset, as an (organisms x sequences) array (element [i, k] is the
+    energy of organisms[i] on dataset[k], as returned by get_energies).
+    
+    Organisms are grouped by structure (number of recognizers and PSSM
+    lengths) and sequences by length: the placement matrices of each group
+    of organisms on each group of sequences are filled together, as a few
+    large array operations instead of one DP per organism and sequence.
+    
+    Energies that are sure to be raised to the threshold are not placed
+    (see OrganismObject.is_below_energy_threshold).
+    
+    Energies are stored in the energy memo, keyed by genome fingerprint and
+    sequence ID, so that only the new genomes (e.g. mutated children) and the
+    sequences they were not placed on yet are computed. Since the memo is
+    keyed by sequence ID, it keeps working when the datasets are shuffled:
+    long-lived organisms are gradually placed on the whole datasets.
+    '''
+    # Cached energies (NaN for the ones that are missing), and their band
+    # cutoff flags
+    energies = np.empty((len(organisms), len(dataset)))
+    band_cutoffs = np.zeros((len(organisms), len(dataset)), dtype=bool)
+    for org_idx, org in enumerate(organisms):
+        energies[org_idx] = org.get_cached_energies(dataset.ids)
+        band_cutoffs[org_idx] = org.get_cached_band_cutoffs(dataset.ids)
+    missing = np.isnan(energies)
+    
+    # Group the sequences by length
+    seq_batches = []
+    for length in np.unique(dataset.lengths):
+        batch_idx = np.flatnonzero(dataset.lengths == length)
+        seq_batches.append(batch_idx)
+    
+    # Group the organisms by structure
+    org_groups = {}
+    for org_idx, org in enumerate(organisms):
+        org_groups.setdefault(org.placement_plan.recog_lengths, []).append(org_idx)
+    
+    for org_idxs in org_groups.values():
+        org_idxs = np.array(org_idxs)
+        for batch_idx in seq_batches:
+            # Energies sure to be raised to the threshold are not placed
+            for org_idx in org_idxs:
+                seq_idxs = batch_idx[missing[org_idx, batch_idx]]
+                if len(seq_idxs) == 0:
+                    continue
+                org = organisms[org_idx]
+                below = org.is_below_energy_threshold(
+                    np.stack([dataset[seq_idx] for seq_idx in seq_idxs]),
+                    dataset.ids[seq_idxs])
+                energies[org_idx, seq_idxs[below]] = org.energy_threshold_value
+                missing[org_idx, seq_idxs[below]] = False
+            
+            # Organisms missing some energies on this batch, and the
+            # sequences they miss
+            batch_missing = missing[np.ix_(org_idxs, batch_idx)]
+            group_idxs = org_idxs[batch_missing.any(axis=1)]
+            if len(group_idxs) == 0:
+                continue
+            batch_idx = batch_idx[batch_missing.any(axis=0)]
+            group = [organisms[org_idx] for org_idx in group_idxs]
+            batch = np.stack([dataset[seq_idx] for seq_idx in batch_idx])
+            (energies[np.ix_(group_idxs, batch_idx)],
+             band_cutoffs[np.ix_(group_idxs, batch_idx)]) = get_group_energies(
+                group, batch, dataset.ids[batch_idx])
+    
+    # Lower bound to the energies (organism-specific)
+    for org_idx, org in enumerate(organisms):
+        energies[org_idx] = org.apply_energy_threshold(energies[org_idx])
+        org.set_cached_energies(dataset.ids, energies[org_idx],
+                                band_cutoffs[org_idx])
+    
+    return energies
+
+
+def evaluate_population(organisms: list, positive_set: SequenceDataset,
+                        negative_set: SequenceDataset) -> list:
+    '''
+    Returns the fitness of each organism (see get_population_fitness). The
+    energies of all the organisms on the positive and negative sets are
+    computed first, with one population-level call per set (see
+    get_population_energies).
+    '''
+    pos_energies = get_population_energies(organisms, positive_set)
+    neg_energies = get_population_energies(organisms, negative_set)
+    return list(get_population_fitness(organisms, positive_set, negative_set,
+                                       pos_energies, neg_energies))
+
+
+def evaluate_competitions(competitions: list, positive_set: SequenceDataset,
+                          negative_set: SequenceDataset) -> list:
+    '''
+    Returns the fitness of the organisms of each (population index, parent,
+    child) competition, in order (parent and child of the first competition,
+    then of the second one, and so on), and the number of sequences used by
+    each competition (the sequences each competitor was scored on, summed
+    over parent and child).
+    
+    By default, all the organisms are fully evaluated (see
+    evaluate_population). If RACING_CONFIDENCE is set and the fitness
+    function is "welchs" or "discriminative", the competitions are raced
+    (see race_competitions). If EARLY_ABANDON_SEQUENCES is set and the fitness
+    function is "discriminative" or "boltzmannian", the parents are fully
+    evaluated first, and the children are scored on the positive set and
+    then on the negative set, EARLY_ABANDON_SEQUENCES sequences at a time.
+    After each step, an optimistic fitness is computed for each child, with
+    the energy upper bound of the child on the positive sequences not scored
+    yet (see OrganismObject.get_energy_upper_bounds) and the energy lower
+    bound (the energy threshold, if any) on the negative ones. Both fitness
+    functions can only grow with the positive energies and drop with the
+    negative ones, so a child whose optimistic fitness is below the fitness
+    of its parent can't win the competition: it's not evaluated any further,
+    and its optimistic fitness is returned instead (competitions have the
+    same outcome as with a full evaluation). Abandoned competitions count
+    the full sets for the parent and the sequences the child was scored on.
+    
+    RACING_CONFIDENCE and EARLY_ABANDON_SEQUENCES can't be both set (see
+    set_up).
+    '''
+    n_sequences = len(positive_set) + len(negative_set)
+    if (RACING_CONFIDENCE is not None and
+            FITNESS_FUNCTION in ("welchs", "discriminative")):
+        return race_competitions(competitions, positive_set, negative_set)
+    
+    if (EARLY_ABANDON_SEQUENCES is None or
+            FITNESS_FUNCTION not in ("discriminative", "boltzmannian")):
+        competing_organisms = []
+        for _, first_organism, second_organism in competitions:
+            competing_organisms += [first_organism, second_organism]
+        fitness_values = evaluate_population(competing_organisms, positive_set,
+                                             negative_set)
+        return fitness_values, [2 * n_sequences] * len(competitions)
+    
+    parents = [parent for _, parent, _ in competitions]
+    children = [child for _, _, child in competitions]
+    parent_fitness = evaluate_population(parents, positive_set, negative_set)
+    
+    # Energies of the children (NaN until scored), and their bounds
+    pos_energies = np.full((len(children), len(positive_set)), np.nan)
+    neg_energies = np.full((len(children), len(negative_set)), np.nan)
+    pos_upper_bounds = np.array([child.get_energy_upper_bounds(positive_set.lengths)
+                                 for child in children]).reshape(pos_energies.shape)
+    neg_lower_bounds = np.array([child.apply_energy_threshold(
+                                     np.full(len(negative_set), -1 * np.inf))
+                                 for child in children]).reshape(neg_energies.shape)
+    
+    # Steps of the evaluation: (energies, dataset, first and last sequence)
+    steps = []
+    for energies, dataset in ((pos_energies, positive_set),
+                              (neg_energies, negative_set)):
+        for start in range(0, len(dataset), EARLY_ABANDON_SEQUENCES):
+            steps.append((energies, dataset, start,
+                          min(start + EARLY_ABANDON_SEQUENCES, len(dataset))))
+    
+    child_fitness = [None] * len(children)
+    sequences_used = [2 * n_sequences] * len(children)
+    active = list(range(len(children)))
+    n_scored = 0
+    for energies, dataset, start, stop in steps:
+        # Abandon the children that can't beat their parent (bounds may be
+        # infinite, e.g. if there's no energy threshold)
+        with np.errstate(invalid="ignore", over="ignore"):
+            optimistic_fitness = get_population_fitness(
+                [children[idx] for idx in active], positive_set, negative_set,
+                np.where(np.isnan(pos_energies[active]), pos_upper_bounds[active],
+                         pos_energies[active]),
+                np.where(np.isnan(neg_energies[active]), neg_lower_bounds[active],
+                         neg_energies[active]))
+        still_active = []
+        for idx, optimistic_fitness in zip(active, optimistic_fitness):
+            if optimistic_fitness < parent_fitness[idx] - EARLY_ABANDON_MARGIN:
+                child_fitness[idx] = optimistic_fitness
+                sequences_used[idx] = n_sequences + n_scored
+            else:
+                still_active.append(idx)
+        active = still_active
+        if len(active) == 0:
+            break
+        
+        # Score the children left on the next sequences
+        energies[np.ix_(active, range(start, stop))] = get_population_energies(
+            [children[idx] for idx in active], dataset[start:stop])
+        n_scored += stop - start
+    
+    # Children evaluated on all the sequences
+    if active:
+        full_fitness = get_population_fitness(
+            [children[idx] for idx in active], positive_set, negative_set,
+            pos_energies[active], neg_energies[active])
+        for idx, fitness in zip(active, full_fitness):
+            child_fitness[idx] = fitness
+    
+    fitness_values = []
+    for idx in range(len(competitions)):
+        fitness_values += [parent_fitness[idx], child_fitness[idx]]
+    return fitness_values, sequences_used
+
+
+def race_competitions(competitions: list, positive_set: SequenceDataset,
+                      negative_set: SequenceDataset) -> tuple:
+    '''
+    Returns the fitness of the organisms of each (population index, parent,
+    child) competition, in order, and the number of sequences used by each
+    competition, racing parent and child on growing samples of the sets.
+    
+    Both competitors are scored on the first RACING_SEQUENCES sequences of
+    each set, then on the first 2 * RACING_SEQUENCES, and so on. After each
+    step, a paired t-test compares their fitness on the sample: the fitness
+    difference is a difference of means of per-sequence paired differences
+    (energies for "discriminative", energies divided by the standard error
+    of each competitor on the sample for "welchs"). Each competition may be
+    tested at every step but the last one, so the tests are Bonferroni
+    corrected over those steps (see are_separated), and a competition is
+    wrongly decided with a probability of at most 1 - RACING_CONFIDENCE.
+    Once the difference is significant, the competition is decided: the
+    sample only picks the winner, whose fitness is then computed on the full
+    sets (its energies on the sample come from the energy memo), and the
+    fitness of the loser is returned as -inf. Close calls are scored on the
+    full sets, with the same result as evaluate_population.
+    
+    Decided competitions count the sample for the loser and the full sets
+    for the winner as the sequences used.
+    
+    Competitions are only raced when both competitors use the "mean"
+    cumulative fit method and are within the complexity bounds (the others
+    are fully evaluated).
+    '''
+    n_pos, n_neg = len(positive_set), len(negative_set)
+    fitness_values = [None] * (2 * len(competitions))
+    sequences_used = [2 * (n_pos + n_neg)] * len(competitions)
+    
+    # Number of steps where a competition may be tested (all but the last
+    # one)
+    n_tests = max(-(-max(n_pos, n_neg) // RACING_SEQUENCES) - 1, 1)
+    
+    # Competitions that are raced, and competitions fully evaluated
+    raced = []
+    full = []
+    for k, (_, parent, child) in enumerate(competitions):
+        if is_raceable(parent) and is_raceable(child):
+            raced.append(k)
+        else:
+            full.append(k)
+    
+    if full:
+        competing_organisms = []
+        for k in full:
+            competing_organisms += list(competitions[k][1:])
+        full_fitness = evaluate_population(competing_organisms, positive_set,
+                                           negative_set)
+        for idx, k in enumerate(full):
+            fitness_values[2 * k:2 * k + 2] = full_fitness[2 * idx:2 * idx + 2]
+    
+    # Competitions decided on a sample, with the index of their winner (0 for
+    # the parent, 1 for the child)
+    decided = []
+    active = raced
+    step = 0
+    while active:
+        step += 1
+        n_pos_sample = min(step * RACING_SEQUENCES, n_pos)
+        n_neg_sample = min(step * RACING_SEQUENCES, n_neg)
+        last_step = n_pos_sample == n_pos and n_neg_sample == n_neg
+        pos_sample = positive_set[:n_pos_sample]
+        neg_sample = negative_set[:n_neg_sample]
+        
+        # Energies of the competitors on the samples (parent and child of
+        # each active competition, in order). Energies computed at previous
+        # steps come from the energy memo
+        competing_organisms = []
+        for k in active:
+            competing_organisms += list(competitions[k][1:])
+        pos_energies = get_population_energies(competing_organisms, pos_sample)
+        neg_energies = get_population_energies(competing_organisms, neg_sample)
+        all_sample_fitness = get_population_fitness(
+            competing_organisms, pos_sample, neg_sample, pos_energies,
+            neg_energies)
+        
+        still_active = []
+        for idx, k in enumerate(active):
+            sample_fitness = list(all_sample_fitness[2 * idx:2 * idx + 2])
+            if last_step:
+                fitness_values[2 * k:2 * k + 2] = sample_fitness
+            elif are_separated(pos_energies[2 * idx:2 * idx + 2],
+                               neg_energies[2 * idx:2 * idx + 2], sample_fitness,
+                               n_tests):
+                decided.append((k, int(sample_fitness[1] > sample_fitness[0])))
+                sequences_used[k] = n_pos_sample + n_neg_sample + n_pos + n_neg
+            else:
+                still_active.append(k)
+        active = still_active
+    
+    # Fitness of the winners on the full sets
+    if decided:
+        winners_fitness = evaluate_population(
+            [competitions[k][1 + winner] for k, winner in decided],
+            positive_set, negative_set)
+        for (k, winner), fitness in zip(decided, winners_fitness):
+            fitness_values[2 * k + winner] = fitness
+            fitness_values[2 * k + 1 - winner] = -1 * np.inf
+    
+    return fitness_values, sequences_used
+
+
+def is_raceable(organism) -> bool:
+    '''
+    Returns True if the fitness of the organism is a difference of means of
+    its energies (see race_competitions), i.e. if it uses the "mean"
+    cumulative fit method and it's within the complexity bounds.
+    '''
+    n_nodes = organism.count_nodes()
+    if MAX_NODES != None and n_nodes > MAX_NODES:
+        return False
+    if MIN_NODES != None and n_nodes < MIN_NODES:
+        return False
+    return organism.cumulative_fit_method == "mean"
+
+
+def are_separated(pos_energies: np.ndarray, neg_energies: np.ndarray,
+                  sample_fitness: list, n_tests: int = 1) -> bool:
+    '''
+    Returns True if the fitness of two competitors on a sample of sequences
+    is significantly different at RACING_CONFIDENCE, Bonferroni corrected
+    for n_tests tests (paired t-test, see race_competitions). The positive
+    and negative differences may have different variances, so the degrees
+    of freedom are those of Welch-Satterthwaite.
+    
+    Args:
+        pos_energies: 2xN array with the energies of the competitors on the
+                      positive sample
+        neg_energies: 2xM array with the energies of the competitors on the
+                      negative sample
+        sample_fitness: fitness of the competitors on the samples
+        n_tests: number of tests run on the competition
+    '''
+    n_pos, n_neg = pos_energies.shape[1], neg_energies.shape[1]
+    if n_pos < 2 or n_neg < 2 or sample_fitness[0] == sample_fitness[1]:
+        return False
+    
+    # Per-sequence contributions to the fitness (up to the mean)
+    if FITNESS_FUNCTION == "welchs":
+        st_errors = get_welchs_standard_errors(
+            np.std(pos_energies, axis=1), np.std(neg_energies, axis=1),
+            sequences_to_fit_pos, sequences_to_fit_neg)
+        pos_energies = pos_energies / st_errors[:, None]
+        neg_energies = neg_energies / st_errors[:, None]
+    
+    # Paired differences (second competitor minus first one)
+    pos_diffs = pos_energies[1] - pos_energies[0]
+    neg_diffs = neg_energies[1] - neg_energies[0]
+    difference = np.mean(pos_diffs) - np.mean(neg_diffs)
+    pos_variance = np.var(pos_diffs, ddof=1) / n_pos
+    neg_variance = np.var(neg_diffs, ddof=1) / n_neg
+    st_error = (pos_variance + neg_variance)**(1/2)
+    
+    # The sign of the difference must match the order of the fitness values
+    if np.sign(difference) != np.sign(sample_fitness[1] - sample_fitness[0]):
+        return False
+    if st_error == 0:
+        return True
+    degrees_of_freedom = (pos_variance + neg_variance)**2 / (
+        pos_variance**2 / (n_pos - 1) + neg_variance**2 / (n_neg - 1))
+    critical_value = t_distribution.ppf(
+        1 - (1 - RACING_CONFIDENCE) / (2 * n_tests), degrees_of_freedom)
+    return abs(difference) > critical_value * st_error
+
+
+def get_population_fitness(organisms: list, positive_set: SequenceDataset,
+                           negative_set: SequenceDataset,
+                           pos_energies: np.ndarray,
+                           neg_energies: np.ndarray) -> np.ndarray:
+    '''
+    Returns the fitness of each organism according to FITNESS_FUNCTION (see
+    objects/fitness_functions.py), computed for all the organisms at once
+    from their (organisms x sequences) energies on the sets, with the
+    penalties for organisms outside the complexity bounds (MAX_NODES and
+    MIN_NODES).
+    '''
+    fitness_function = get_fitness_function(FITNESS_FUNCTION)
+    params = {
+        "cumulative_fit_methods": [org.cumulative_fit_method for org in organisms],
+        "neg_lengths": negative_set.lengths,
+        "genome_length": GENOME_LENGTH,
+        "sequences_to_fit_pos": sequences_to_fit_pos,
+        "sequences_to_fit_neg": sequences_to_fit_neg,
+    }
+    fitness = fitness_function(pos_energies, neg_energies, params)
+    
+    for idx, organism in enumerate(organisms):
+        if MAX_NODES != None:  # Upper_bound to complexity
+            if organism.count_nodes() > MAX_NODES:
+                fitness[idx] = -1000 * int(organism.count_nodes())
+        
+        if MIN_NODES != None:  # Lower_bound to complexity
+            if organism.count_nodes() < MIN_NODES:
+                fitness[idx] = -1000 * int(organism.count_nodes())
+    
+    return fitness
 
 
 def get_all_kmers(seq: str, kmer_len: int) -> list:
@@ -630,7 +1006,7 @@ def get_k_sampled_sequence(seq: str, kmer_len: int) -> str:
     return "".join(sampled_seq_list)
 
 
-def generate_negative_set(positive_set: list) -> list:
+def generate_negative_set(positive_set: SequenceDataset) -> SequenceDataset:
     ''' Generates a negative set made of pseudosequences that resemble the
     positive set in terms of k-mer frequencies. If the size of the negative set
     is not specified, it will be the size of the positive set. If the size is
@@ -638,7 +1014,12 @@ def generate_negative_set(positive_set: list) -> list:
     in the positive set contributes to exactly k sequences in the negative set.
     If the required size is not a multiple of len(positive_set), the remaining
     number of sequences (as many as the remainder of the division) are selected
-    randomly from the positive set. '''
+    randomly from the positive set. The IDs of the generated sequences continue
+    after the ones of the positive set. '''
+    
+    # k-mer sampling works on DNA strings
+    positive_set_strings = [positive_set.get_sequence_string(i)
+                            for i in range(len(positive_set))]
     
     if GENERATED_NEG_SET_SIZE is None:
         neg_set_size = len(positive_set)
@@ -648,11 +1029,11 @@ def generate_negative_set(positive_set: list) -> list:
     r = neg_set_size % len(positive_set)
     negative_set = []
     for i in range(q):
-        for seq in positive_set:
+        for seq in positive_set_strings:
             negative_set.append(get_k_sampled_sequence(seq, GENERATED_NEG_SET_KMER_LEN))
-    for seq in random.sample(positive_set, r):
+    for seq in random.sample(positive_set_strings, r):
         negative_set.append(get_k_sampled_sequence(seq, GENERATED_NEG_SET_KMER_LEN))
-    return negative_set
+    return SequenceDataset.from_strings(negative_set, first_id=len(positive_set))
 
 
 def is_finished(
@@ -679,13 +1060,76 @@ def is_finished(
         return max_score >= MIN_FITNESS
 
     if method.lower() == "threshold":
-        return abs(last_max_score - max_score) <= THRESHOLD
+        # Runs with a growing sample size go on until the full sample is used
+        return (is_stagnated(max_score, last_max_score) and
+                sequences_to_fit_pos == MAX_SEQUENCES_TO_FIT_POS and
+                sequences_to_fit_neg == MAX_SEQUENCES_TO_FIT_NEG)
 
     return True
 
 
+def is_stagnated(max_score: float, last_max_score: float) -> bool:
+    ''' Returns True if the max score changed by THRESHOLD or less since the
+    last iteration. '''
+    return abs(last_max_score - max_score) <= THRESHOLD
+
+
+def update_sample_size(max_score: float, last_max_score: float,
+                       fitness_values: list) -> bool:
+    '''
+    Grows the number of sequences of each set used to compute fitness by
+    SAMPLE_SIZE_GROWTH_FACTOR (up to MAX_SEQUENCES_TO_FIT_POS/NEG), when the
+    condition of SAMPLE_SIZE_SCHEDULE is met:
+        "stagnation": the max score changed by THRESHOLD or less since the
+                      last iteration (see is_stagnated)
+        "variance": the standard deviation of the fitness of the population
+                    is SAMPLE_SIZE_VARIANCE_THRESHOLD times its mean
+                    absolute value or less
+    
+    Small samples are enough to tell random organisms apart, while the
+    organisms of a converged population need larger ones. Returns True if
+    the samples were grown.
+    
+    Args:
+        max_score: max score recorded on the last iteration
+        last_max_score: max score recorded on the iteration before
+        fitness_values: fitness of the organisms of the population on the
+                        last iteration
+    '''
+    global sequences_to_fit_pos
+    global sequences_to_fit_neg
+    
+    if (sequences_to_fit_pos == MAX_SEQUENCES_TO_FIT_POS and
+            sequences_to_fit_neg == MAX_SEQUENCES_TO_FIT_NEG):
+        return False
+    
+    grow = False
+    if i_am_main_process():
+        if SAMPLE_SIZE_SCHEDULE == "stagnation":
+            grow = is_stagnated(max_score, last_max_score)
+        elif SAMPLE_SIZE_SCHEDULE == "variance":
+            grow = (np.std(fitness_values) <=
+                    SAMPLE_SIZE_VARIANCE_THRESHOLD *
+                    np.mean(np.abs(fitness_values)))
+        else:
+            raise ValueError('SAMPLE_SIZE_SCHEDULE should be null, ' +
+                             '"stagnation" or "variance".')
+    if RUN_MODE == 'parallel':
+        # All the processes grow their samples when process 0 does
+        grow = comm.bcast(grow, root=0)
+    
+    if grow:
+        sequences_to_fit_pos = min(
+            int(np.ceil(sequences_to_fit_pos * SAMPLE_SIZE_GROWTH_FACTOR)),
+            MAX_SEQUENCES_TO_FIT_POS)
+        sequences_to_fit_neg = min(
+            int(np.ceil(sequences_to_fit_neg * SAMPLE_SIZE_GROWTH_FACTOR)),
+            MAX_SEQUENCES_TO_FIT_NEG)
+    return grow
+
+
 def export_organism(
-        organism, dataset: list, filename: str, factory: OrganismFactory
+        organism, dataset: SequenceDataset, filename: str, factory: OrganismFactory
 ) -> None:
     """Exports a single organism in json format, visual format and its
     recognizers binding
@@ -709,7 +1153,7 @@ def export_organism(
 
 
 def export_population(
-        population, dataset: list, factory: OrganismFactory,
+        population, dataset: SequenceDataset, factory: OrganismFactory,
         generation: int, dna_seq_idx: int
 ) -> None:
     """Exports a single organism in json format, visual format and its
@@ -872,6 +1316,15 @@ def set_up():
     global PERIODIC_POP_EXPORT
     global MAX_NODES
     global MIN_NODES
+    global EARLY_ABANDON_SEQUENCES
+    global RACING_CONFIDENCE
+    global RACING_SEQUENCES
+    global SAMPLE_SIZE_SCHEDULE
+    global INITIAL_SEQUENCES_TO_FIT
+    global SAMPLE_SIZE_GROWTH_FACTOR
+    global SAMPLE_SIZE_VARIANCE_THRESHOLD
+    global sequences_to_fit_pos
+    global sequences_to_fit_neg
 
     # Config data
     global configOrganism
@@ -931,9 +1384,35 @@ def set_up():
     OUTPUT_FILENAME = config["main"]["OUTPUT_FILENAME"]
     PERIODIC_ORG_EXPORT = config["main"]["PERIODIC_ORG_EXPORT"]
     PERIODIC_POP_EXPORT = config["main"]["PERIODIC_POP_EXPORT"]
+    EARLY_ABANDON_SEQUENCES = config["main"]["EARLY_ABANDON_SEQUENCES"]
+    RACING_CONFIDENCE = config["main"]["RACING_CONFIDENCE"]
+    RACING_SEQUENCES = config["main"]["RACING_SEQUENCES"]
+    if RACING_CONFIDENCE is not None and EARLY_ABANDON_SEQUENCES is not None:
+        raise ValueError("RACING_CONFIDENCE and EARLY_ABANDON_SEQUENCES " +
+                         "can't be both set.")
+    SAMPLE_SIZE_SCHEDULE = config["main"]["SAMPLE_SIZE_SCHEDULE"]
+    INITIAL_SEQUENCES_TO_FIT = config["main"]["INITIAL_SEQUENCES_TO_FIT"]
+    SAMPLE_SIZE_GROWTH_FACTOR = config["main"]["SAMPLE_SIZE_GROWTH_FACTOR"]
+    SAMPLE_SIZE_VARIANCE_THRESHOLD = config["main"]["SAMPLE_SIZE_VARIANCE_THRESHOLD"]
     MAX_NODES = config["organism"]["MAX_NODES"]
     MIN_NODES = config["organism"]["MIN_NODES"]
     
+    # Initial number of sequences used to compute fitness
+    if SAMPLE_SIZE_SCHEDULE is None:
+        sequences_to_fit_pos = MAX_SEQUENCES_TO_FIT_POS
+        sequences_to_fit_neg = MAX_SEQUENCES_TO_FIT_NEG
+    else:
+        sequences_to_fit_pos = min(INITIAL_SEQUENCES_TO_FIT, MAX_SEQUENCES_TO_FIT_POS)
+        sequences_to_fit_neg = min(INITIAL_SEQUENCES_TO_FIT, MAX_SEQUENCES_TO_FIT_NEG)
+    
+    # Bound to the number of energies stored by the energy memo
+    energy_memo.set_max_entries(config["main"]["ENERGY_MEMO_MAX_ENTRIES"])
+    # Bound to the size of the PSSM scans stored by the scan cache
+    scan_cache.set_max_bytes(config["main"]["SCAN_CACHE_MAX_MB"] * 2**20)
+    # Bound to the size of the placement rows stored by the frontier cache
+    # (0 disables it)
+    frontier_cache.set_max_bytes(config["main"]["FRONTIER_CACHE_MAX_MB"] * 2**20)
+    
     # Create directory where the output and results will be stored
     if i_am_main_process():  # XXX
         check_dir(RESULT_BASE_PATH_DIR)
@@ -964,18 +1443,17 @@ def set_up():
         print_ln("-" * 50, parameters_path)
 
 
-def read_fasta_file(filename: str) -> list:
-    """Reads a fasta file and returns an array of DNA sequences (strings)
-
-    TODO: probably it can be useful to create our own Sequence object that
-    creates the string and stores some properties from fasta format. Also
-    we can adapt the current program to use Biopythons's Seq object.
+def read_fasta_file(filename: str, first_id: int = 0) -> SequenceDataset:
+    """Reads a fasta file and returns a dataset of DNA sequences, encoded as
+    arrays of base indexes.
 
     Args:
         filename: Name of the file that contains FASTA format sequences to read
+        first_id: ID of the first sequence of the file (the following ones
+                  are numbered consecutively, in the order of the file)
 
     Returns:
-        The set of sequences in string format
+        The set of sequences as a SequenceDataset
 
     """
     dataset = []
@@ -985,7 +1463,7 @@ def read_fasta_file(filename: str) -> list:
     for fasta in fasta_sequences:
         dataset.append(str(fasta.seq).lower())
 
-    return dataset
+    return SequenceDataset.from_strings(dataset, first_id=first_id)
 
 
 def read_json_file(filename: str) -> dict:
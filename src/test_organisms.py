@@ -31,7 +31,8 @@ def main():
     input_organisms_path = config["main"]["INPUT_FILENAME"]
     positive_dataset = read_fasta_file(positive_path)
     #positive_dataset.sort()
-    negative_dataset = read_fasta_file(negative_path)
+    negative_dataset = read_fasta_file(negative_path,
+                                       first_id=len(positive_dataset))
     #print("{} {}".format(len(positive_dataset), len(negative_dataset)))
     
     genome_length = config["main"]["GENOME_LENGTH"]